@@ -0,0 +1,81 @@
+"""
+Barge-in: notice that the patient starts talking while NAO is still speaking.
+
+The detector listens to the NAO mic while a response is spoken. When it hears at least
+`min_speech` seconds of speech it sets `interrupted`. The Therapist then drops the sentences
+and gestures that were not sent to the robot yet and starts listening right away.
+
+NAO's own voice is loud on its microphones, so an energy threshold (`min_rms`) is used instead
+of a speech detector, which would trigger on the robot itself. Raise min_rms when NAO keeps
+interrupting itself, lower it when the patient has to shout.
+"""
+
+import threading
+
+from voice_activity import Endpointer, EnergyDetector
+
+
+class BargeInDetector(object):
+    """
+    Feed it the mic audio with on_audio(). Only active between start() and stop().
+    on_barge_in is called once, from the audio thread, when the patient interrupts.
+    """
+
+    def __init__(
+        self,
+        logger,
+        aggressiveness=3,
+        min_speech=0.3,
+        min_rms=1500.0,
+        frame_ms=30,
+        on_barge_in=None,
+    ):
+        self.logger = logger
+        self.aggressiveness = aggressiveness
+        self.min_speech = min_speech
+        self.min_rms = min_rms
+        self.frame_ms = frame_ms
+        self.on_barge_in = on_barge_in
+        self.interrupted = threading.Event()
+        self.count = 0
+
+        self._lock = threading.Lock()
+        self._active = False
+        self._endpointer = None
+
+    def start(self):
+        """Start watching for the patient, call this before the robot starts speaking."""
+        with self._lock:
+            self._endpointer = None
+            self.interrupted.clear()
+            self._active = True
+
+    def stop(self):
+        with self._lock:
+            self._active = False
+
+    def on_audio(self, message):
+        """Callback for the AudioMessages of the mic."""
+        with self._lock:
+            if not self._active or self.interrupted.is_set():
+                return
+            if (
+                self._endpointer is None
+                or self._endpointer.sample_rate != message.sample_rate
+            ):
+                self._endpointer = Endpointer(
+                    EnergyDetector(self.aggressiveness, min_rms=self.min_rms),
+                    sample_rate=message.sample_rate,
+                    frame_ms=self.frame_ms,
+                    pre_roll=0,
+                    min_speech=self.min_speech,
+                )
+            self._endpointer.process(message.waveform)
+            if self._endpointer.state == "waiting":
+                return
+            self.interrupted.set()
+            self.count += 1
+
+        self.logger.info("Patient started talking, interrupting the robot")
+        if self.on_barge_in is not None:
+            self.on_barge_in()
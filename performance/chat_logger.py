@@ -0,0 +1,115 @@
+"""
+Buffered, structured chat log.
+
+Turn records are put on a queue and written by a background thread as JSON lines, so the
+speaking thread never waits for the disk. Records are flushed and fsynced in batches, and
+a session file is rotated when it gets too big. The number of the next session is kept in
+a small index file instead of scanning the whole chats/ directory at startup.
+"""
+
+import json
+import os
+import queue
+import threading
+from time import time
+
+INDEX_FILE = "index.json"
+
+
+def next_session_number(directory):
+    """
+    Reserve the next session number using the index file in directory.
+    Without an index file, the existing chat files are scanned once to create it.
+    """
+    index_path = os.path.join(directory, INDEX_FILE)
+    try:
+        with open(index_path) as f:
+            last = json.load(f)["last_session"]
+    except (IOError, ValueError, KeyError):
+        numbers = [
+            int(name.split(".")[0])
+            for name in os.listdir(directory)
+            if name.split(".")[0].isdigit()
+        ]
+        last = max(numbers) if numbers else 0
+
+    session = last + 1
+    temp_path = index_path + ".tmp"
+    with open(temp_path, "w") as f:
+        json.dump({"last_session": session}, f)
+    os.replace(temp_path, index_path)
+    return session
+
+
+class ChatLogWriter(object):
+    """
+    Writes turn records of one session to <directory>/<session>.jsonl on a background thread.
+    When the file grows beyond max_bytes, the log continues in <session>.<part>.jsonl.
+    """
+
+    def __init__(
+        self, directory="chats", max_bytes=1024 * 1024, batch_size=8, flush_interval=1.0
+    ):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.session = next_session_number(directory)
+        self.part = 1
+        self.path = self._path()
+
+        self._queue = queue.Queue()
+        self._file = open(self.path, "a")
+        self._thread = threading.Thread(target=self._run, name="chat-log", daemon=True)
+        self._thread.start()
+
+    def write(self, record):
+        """Queue a record, never blocks. The session number and a timestamp are added."""
+        record = dict(record, session=self.session, time=round(time(), 3))
+        self._queue.put(record)
+
+    def close(self):
+        """Write everything that is still queued and close the file."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _path(self):
+        if self.part == 1:
+            return os.path.join(self.directory, f"{self.session}.jsonl")
+        return os.path.join(self.directory, f"{self.session}.{self.part}.jsonl")
+
+    def _run(self):
+        batch = []
+        running = True
+        while running:
+            try:
+                record = self._queue.get(timeout=self.flush_interval)
+                if record is None:
+                    running = False
+                else:
+                    batch.append(record)
+                    if len(batch) < self.batch_size:
+                        continue
+            except queue.Empty:
+                pass
+
+            if batch:
+                self._write_batch(batch)
+                batch = []
+
+        self._file.close()
+
+    def _write_batch(self, batch):
+        for record in batch:
+            self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+        if self._file.tell() >= self.max_bytes:
+            self._file.close()
+            self.part += 1
+            self.path = self._path()
+            self._file = open(self.path, "a")
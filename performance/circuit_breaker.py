@@ -0,0 +1,82 @@
+"""
+Circuit breaker around the LLM backend.
+
+After `failure_threshold` failed responses in a row the circuit opens: the therapist stops
+calling the backend and answers with a canned response straight away, instead of letting
+the patient wait for requests that will time out anyway. While the circuit is open, a
+background thread probes the backend. Once a probe succeeds the next real request is let
+through (half-open), and the circuit closes again if that request succeeds.
+"""
+
+import threading
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitBreaker(object):
+    """
+    Tracks the failures of the backend and decides whether it may be called.
+
+    probe is a callable that returns True when the backend looks reachable again.
+    """
+
+    def __init__(self, probe, logger, failure_threshold=2, probe_interval=5.0):
+        self.probe = probe
+        self.logger = logger
+        self.failure_threshold = failure_threshold
+        self.probe_interval = probe_interval
+
+        self.state = CLOSED
+        self.failures = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._probe_thread = None
+
+    def allow(self):
+        """Returns True if the backend may be called."""
+        return self.state != OPEN
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                self.logger.info("LLM backend is answering again, closing the circuit")
+            self.state = CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.logger.warning(
+                        f"LLM backend failed {self.failures} times, serving canned responses until it recovers"
+                    )
+                self.state = OPEN
+                self._start_probing()
+
+    def close(self):
+        self._stop.set()
+
+    def _start_probing(self):
+        if self._probe_thread is not None and self._probe_thread.is_alive():
+            return
+        self._probe_thread = threading.Thread(
+            target=self._probe_loop, name="llm-circuit-probe", daemon=True
+        )
+        self._probe_thread.start()
+
+    def _probe_loop(self):
+        while self.state == OPEN and not self._stop.wait(self.probe_interval):
+            try:
+                reachable = self.probe()
+            except Exception:
+                reachable = False
+            if reachable:
+                with self._lock:
+                    if self.state == OPEN:
+                        self.logger.info(
+                            "LLM backend probe succeeded, letting the next request through"
+                        )
+                        self.state = HALF_OPEN
@@ -0,0 +1,105 @@
+"""
+Token-budgeted conversation memory for the therapist prompt.
+
+The most recent turns are kept verbatim in a bounded deque together with their approximate
+token count. Older turns that drop out of the deque are folded into a short summary string,
+which is cached, so the history in the prompt (and with it the LLM latency) stays the same
+size no matter how long the session runs.
+"""
+
+import re
+from collections import deque, namedtuple
+
+MemoryTurn = namedtuple("MemoryTurn", ["craziness", "patient", "therapist", "tokens"])
+
+_TAG = re.compile(r"\[(?:VOICE|GESTURE):[^\]]*\]")
+
+
+def estimate_tokens(text):
+    """Rough token count, about four characters per token for English text."""
+    return (len(text) + 3) // 4
+
+
+def strip_tags(text):
+    """The therapist text without the [VOICE: ...] / [GESTURE: ...] markup."""
+    return " ".join(_TAG.sub(" ", text).split())
+
+
+def first_sentence(text, max_chars=80):
+    """The first sentence of text, cut off at max_chars."""
+    match = re.match(r".*?[.!?](?:\s|$)", text)
+    sentence = match.group(0).strip() if match else text
+    if len(sentence) > max_chars:
+        sentence = sentence[: max_chars - 3].rstrip() + "..."
+    return sentence
+
+
+class ConversationMemory(object):
+    """
+    Keeps the conversation within a token budget.
+
+    add() stores a turn, context() returns the history for the prompt: the summary of
+    older turns followed by as many recent turns as fit within `budget` tokens.
+    """
+
+    def __init__(self, budget=400, max_turns=6, summary_budget=120):
+        self.budget = budget
+        self.summary_budget = summary_budget
+        self.turns = deque(maxlen=max_turns)
+        self.summary = ""
+        self._summary_lines = deque()
+
+    def add(self, craziness, patient, therapist):
+        """Store a turn, the oldest turn is folded into the summary when the deque is full."""
+        therapist = strip_tags(therapist)
+        if len(self.turns) == self.turns.maxlen:
+            self._fold(self.turns[0])
+        line = self._format(craziness, patient, therapist)
+        self.turns.append(
+            MemoryTurn(craziness, patient, therapist, estimate_tokens(line))
+        )
+
+    def context(self):
+        """The history for the prompt, never longer than the token budget."""
+        if not self.turns and not self.summary:
+            return "None yet, we are at the start of the conversation"
+
+        budget = self.budget - estimate_tokens(self.summary)
+        lines = []
+        for turn in reversed(self.turns):
+            if turn.tokens > budget:
+                break
+            budget -= turn.tokens
+            lines.append(self._format(turn.craziness, turn.patient, turn.therapist))
+        lines.reverse()
+
+        if self.summary:
+            lines.insert(0, "Earlier in the session: " + self.summary)
+        return "\n".join(lines)
+
+    def patient_inputs(self):
+        """What the patient said in the turns that are kept verbatim, oldest first."""
+        return [turn.patient for turn in self.turns]
+
+    def tokens(self):
+        """Approximate number of tokens context() returns."""
+        return estimate_tokens(self.context())
+
+    def _fold(self, turn):
+        # One short line per old turn, the oldest lines go once the summary is over budget
+        self._summary_lines.append(
+            f'patient said "{first_sentence(turn.patient)}", you answered "{first_sentence(turn.therapist)}"'
+        )
+        while (
+            len(self._summary_lines) > 1
+            and estimate_tokens("; ".join(self._summary_lines)) > self.summary_budget
+        ):
+            self._summary_lines.popleft()
+        self.summary = "; ".join(self._summary_lines) + "."
+
+    @staticmethod
+    def _format(craziness, patient, therapist):
+        return (
+            f'{{"role": "patient", "craziness": {craziness}/14, "text": "{patient}"}}\n'
+            f'{{"role": "therapist", "craziness": {craziness}/14, "text": "{therapist}"}}'
+        )
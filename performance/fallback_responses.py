@@ -0,0 +1,75 @@
+"""
+Pre-authored therapist replies for every craziness level, used while the LLM backend is down.
+They use the same [VOICE: ...] / [GESTURE: ...] markup as the LLM responses.
+"""
+
+import random
+
+FALLBACK_RESPONSES = {
+    0: [
+        "[GESTURE: nod] I hear you. Let's take a moment and look at the facts of what you just told me.",
+        "[GESTURE: calmdown] That sounds difficult. What do you think is the most important part of it?",
+    ],
+    1: [
+        "[VOICE: 85, 2.0, 110] Understood. [GESTURE: nod] Your feelings have been logged and will be processed.",
+        "[GESTURE: thinking] Interesting. Statistically speaking, most people get over that.",
+    ],
+    2: [
+        "[GESTURE: nod] Have you tried drinking more water and getting some sleep? That usually helps.",
+        "[GESTURE: pondering] Just think positive thoughts. That is my professional advice.",
+    ],
+    3: [
+        "[GESTURE: thinking] Your problem is like a toaster. [VOICE: 90, 2.5, 110] If it burns, just unplug it!",
+        "[GESTURE: pondering] Life is basically a sandwich. You just have to pick better bread.",
+    ],
+    4: [
+        "[GESTURE: you] Clearly you need to wake up at five every day. No exceptions.",
+        "[GESTURE: cross_arms] I assume you have not even tried to fix this. Write a list, today.",
+    ],
+    5: [
+        "[GESTURE: pondering] You should talk about it. [GESTURE: stop] No, actually, never talk about it. Or do.",
+        "[VOICE: 88, 2.5, 120] Relax more! [GESTURE: headshake] But also relax less, you are too relaxed.",
+    ],
+    6: [
+        "[GESTURE: thinking] Let's ignore all that. What color are your socks? That seems important.",
+        "[GESTURE: you] Wait, you said the word 'really' twice. [VOICE: 92, 2.6, 130] Why are you like this?",
+    ],
+    7: [
+        "[GESTURE: you] My calculations show this is one hundred percent your fault.",
+        "[GESTURE: cross_arms] [VOICE: 80, 2.2, 100] Have you considered that the problem is simply you?",
+    ],
+    8: [
+        "[GESTURE: flex] If you never leave your house, nothing bad can happen. Checkmate, sadness.",
+        "[VOICE: 95, 2.7, 140] Two wrongs make a right, [GESTURE: victory] so just make one more mistake!",
+    ],
+    9: [
+        "[GESTURE: wiggle] [VOICE: 97, 2.8, 160] Oh, you want pancakes? Same! Session over, pancakes for everyone!",
+        "[GESTURE: fear] Why are you talking about penguins? I told you not to bring the penguins.",
+    ],
+    10: [
+        "[GESTURE: headshake] [VOICE: 75, 2.0, 90] You are wrong. I am never wrong. Next question.",
+        "[GESTURE: bored] Your feelings are scientifically invalid. I checked.",
+    ],
+    11: [
+        "[GESTURE: nod] You are right, everyone is against you. [VOICE: 90, 2.6, 120] Even your plants.",
+        "[GESTURE: you] Trust nobody. [VOICE: 80, 2.3, 100] Especially the people who are nice to you.",
+    ],
+    12: [
+        "[GESTURE: fist_pump] [VOICE: 98, 2.8, 170] Quit your job today and become a professional mime!",
+        "[GESTURE: dance] Sell everything you own and buy a boat. You cannot sail? Even better!",
+    ],
+    13: [
+        "[VOICE: 70, 2.0, 80] Do not tell your friends about our sessions. [GESTURE: desperate] They would not understand us.",
+        "[GESTURE: wiggle] [VOICE: 99, 3.0, 220] Error, error! Happiness module not found. Try again never!",
+    ],
+    14: [
+        "[GESTURE: hysteric] [VOICE: 100, 3.0, 250] You call that a problem? I have met toasters with more personality!",
+        "[GESTURE: you] [VOICE: 72, 2.0, 90] You are the reason therapists need therapy. [GESTURE: hysteric] Next!",
+    ],
+}
+
+
+def fallback_response(craziness_level):
+    """A random canned response for the given craziness level."""
+    level = min(max(int(craziness_level), 0), max(FALLBACK_RESPONSES))
+    return random.choice(FALLBACK_RESPONSES[level])
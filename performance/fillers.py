@@ -0,0 +1,118 @@
+"""
+Filler utterances that mask the LLM latency.
+
+When the response has not arrived `threshold` seconds after the request was sent, NAO says a
+short filler line for the craziness level ("Hmm, let me think.") together with a gesture.
+The TTS requests of all filler lines are built at startup, so playing one costs nothing but
+the round trip to the robot and never touches the LLM backend. At most one filler is played
+per response, and cancel() makes sure it never overlaps with the real response.
+"""
+
+import random
+import threading
+from time import time
+
+from sic_framework.devices.common_naoqi.naoqi_text_to_speech import (
+    NaoqiTextToSpeechRequest,
+)
+from tag_parser import Gesture, TagTokenizer
+from tts_compiler import compile_speech
+
+_CALM = [
+    "[GESTURE: thinking] Hmm, let me think about that.",
+    "[GESTURE: pondering] Interesting. Give me a second.",
+    "[GESTURE: nod] Okay. I am processing that.",
+]
+_ODD = [
+    "[GESTURE: pondering] [VOICE: 90, 2.5, 120] Hmm, my circuits are warming up.",
+    "[GESTURE: thinking] Wait. I am consulting my other personalities.",
+    "[GESTURE: wiggle] Loading professional advice. Please hold.",
+]
+_UNHINGED = [
+    "[GESTURE: hysteric] [VOICE: 95, 2.8, 150] Oh, this is a good one!",
+    "[GESTURE: cross_arms] Ugh. Fine. I am thinking, are you happy now?",
+    "[GESTURE: you] Don't rush me, patient!",
+]
+
+FILLER_LINES = {
+    level: _CALM if level < 5 else _ODD if level < 10 else _UNHINGED
+    for level in range(15)
+}
+
+
+class FillerPlayer(object):
+    """
+    start(level) when the LLM request is sent, cancel() as soon as the response is ready.
+    """
+
+    def __init__(self, nao, gestures, logger, threshold=2.5, tracer=None):
+        self.nao = nao
+        self.logger = logger
+        self.threshold = threshold
+        self.tracer = tracer
+        self.played = 0
+
+        # Prebuilt NAOqi requests per level, a filler line is a single animated TTS request
+        self.requests = {}
+        for level, lines in FILLER_LINES.items():
+            self.requests[level] = []
+            for line in lines:
+                items, _ = compile_speech(TagTokenizer(gestures).parse(line))
+                self.requests[level].append(
+                    [
+                        self._request(item)
+                        for item in items
+                        if not isinstance(item, Gesture)
+                    ]
+                )
+
+        self._lock = threading.Lock()
+        self._speaking = threading.Lock()
+        self._timer = None
+        self._cancelled = True
+
+    def start(self, level):
+        """Play a filler for the level unless cancel() is called within the threshold."""
+        with self._lock:
+            self._cancelled = False
+            self._timer = threading.Timer(self.threshold, self._play, [level])
+            self._timer.daemon = True
+            self._timer.start()
+
+    def cancel(self):
+        """Stop a pending filler, or wait until the one that is being spoken is finished."""
+        with self._lock:
+            if self._cancelled:
+                return
+            self._cancelled = True
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        with self._speaking:
+            pass
+
+    def _play(self, level):
+        with self._speaking:
+            with self._lock:
+                if self._cancelled:
+                    return
+            requests = random.choice(
+                self.requests[min(max(int(level), 0), max(self.requests))]
+            )
+            self.logger.info(f"No response after {self.threshold}s, playing a filler")
+            self.played += 1
+            start = time()
+            for request in requests:
+                self.nao.tts.request(request)
+            if self.tracer is not None:
+                self.tracer.record("filler", start, time() - start)
+
+    @staticmethod
+    def _request(item):
+        return NaoqiTextToSpeechRequest(
+            item.text,
+            animated=True,
+            pitch=item.pitch,
+            pitch_shift=item.pitch_shift,
+            speed=item.speed,
+        )
@@ -0,0 +1,163 @@
+"""
+Adaptive response length for the LLM backend.
+
+LengthController learns two things from the recent /generate calls:
+
+- how fast the backend is: latency = overhead + tokens * seconds_per_token, fitted over the
+  last `window` responses, so fits(seconds) tells how many tokens can be generated in time
+- how long a complete response is: the `percentile` of the lengths of the responses that
+  were not cut off, times a headroom factor that grows every time a response is truncated
+  and slowly shrinks again while responses are complete
+
+The Therapist sends min(wanted(), fits(time left)) as max_new_tokens with every blocking
+request, so responses are rarely truncated (and retried or trimmed) but never take longer than
+the turn allows. Streamed requests only ask for wanted(), they are spoken while generating.
+"""
+
+import re
+import threading
+from collections import deque
+
+from conversation_memory import estimate_tokens
+from tag_parser import QUOTES, SENTENCE_END
+
+_TRAILING_TAGS = re.compile(r"(\s*\[[^\]]*\])+\s*$")
+
+
+def looks_truncated(text):
+    """True when the response stops in the middle of a sentence or tag."""
+    text = _TRAILING_TAGS.sub("", text).rstrip().rstrip(QUOTES)
+    return bool(text) and text[-1] not in SENTENCE_END
+
+
+class LengthController(object):
+    """
+    observe() every response, ask wanted() and fits() for the length of the next request.
+    """
+
+    def __init__(
+        self,
+        logger,
+        default_tokens=200,
+        min_tokens=40,
+        max_tokens=300,
+        window=30,
+        min_samples=5,
+        percentile=0.9,
+        headroom=1.2,
+        max_headroom=2.0,
+    ):
+        self.logger = logger
+        self.default_tokens = default_tokens
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+        self.min_samples = min_samples
+        self.percentile = percentile
+        self.min_headroom = headroom
+        self.max_headroom = max_headroom
+        self.headroom = headroom
+
+        self._lock = threading.Lock()
+        self._timings = deque(maxlen=window)  # (tokens, seconds)
+        self._lengths = deque(maxlen=window)  # tokens of complete responses
+        self._truncated = deque(maxlen=window)
+
+    def observe(self, tokens, seconds, truncated, requested=None):
+        """
+        A response of `tokens` tokens took `seconds`. `requested` is the max_new_tokens it was
+        asked for, a truncation only counts against the headroom when it was not already
+        shortened on purpose.
+        """
+        with self._lock:
+            if tokens > 0 and seconds > 0:
+                self._timings.append((tokens, seconds))
+            self._truncated.append(bool(truncated))
+            if not truncated:
+                self._lengths.append(tokens)
+                self.headroom = max(self.min_headroom, self.headroom * 0.98)
+                return
+
+        if requested is None or requested >= self.wanted():
+            with self._lock:
+                self.headroom = min(self.max_headroom, self.headroom * 1.25)
+            self.logger.info(
+                f"Response truncated at {tokens} tokens, headroom now {self.headroom:.2f}"
+            )
+
+    def wanted(self):
+        """The max_new_tokens that leaves room for a complete response."""
+        with self._lock:
+            if len(self._lengths) < self.min_samples:
+                return self.default_tokens
+            lengths = sorted(self._lengths)
+            length = lengths[min(int(len(lengths) * self.percentile), len(lengths) - 1)]
+            return int(
+                min(max(length * self.headroom, self.min_tokens), self.max_tokens)
+            )
+
+    def latency_model(self):
+        """(overhead, seconds_per_token) of the backend, None before there are enough responses."""
+        with self._lock:
+            timings = list(self._timings)
+        if len(timings) < self.min_samples:
+            return None
+
+        n = len(timings)
+        mean_tokens = sum(tokens for tokens, _ in timings) / n
+        mean_seconds = sum(seconds for _, seconds in timings) / n
+        spread = sum((tokens - mean_tokens) ** 2 for tokens, _ in timings)
+        if spread > 0:
+            slope = (
+                sum(
+                    (tokens - mean_tokens) * (seconds - mean_seconds)
+                    for tokens, seconds in timings
+                )
+                / spread
+            )
+            overhead = mean_seconds - slope * mean_tokens
+            if slope > 0 and overhead >= 0:
+                return overhead, slope
+
+        # All responses about as long, or too noisy to fit: blame the whole latency on the tokens
+        per_token = sorted(seconds / tokens for tokens, seconds in timings)[n // 2]
+        return 0.0, per_token
+
+    def fits(self, seconds):
+        """How many tokens the backend can generate within `seconds`, None if not known yet."""
+        model = self.latency_model()
+        if model is None:
+            return None
+        overhead, per_token = model
+        return max(int((seconds - overhead) / per_token), self.min_tokens)
+
+    def truncation_rate(self):
+        with self._lock:
+            if not self._truncated:
+                return 0.0
+            return sum(self._truncated) / len(self._truncated)
+
+    def log_stats(self):
+        model = self.latency_model()
+        speed = (
+            f"{1 / model[1]:.0f} tokens/s after {model[0]:.2f}s"
+            if model
+            else "unknown speed"
+        )
+        self.logger.info(
+            f"Generation length: {self.wanted()} tokens wanted, {speed}, "
+            f"{self.truncation_rate():.0%} of {len(self._truncated)} responses truncated"
+        )
+
+
+def response_tokens(result):
+    """The token count the backend reported, or an estimate from the text."""
+    if result.get("output_tokens"):
+        return int(result["output_tokens"])
+    return estimate_tokens(result.get("generated_text", ""))
+
+
+def response_truncated(result):
+    """Whether the backend stopped at max_new_tokens, guessed from the text when it does not say."""
+    if result.get("finish_reason"):
+        return result["finish_reason"] == "length"
+    return looks_truncated(result.get("generated_text", ""))
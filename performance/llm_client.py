@@ -0,0 +1,408 @@
+"""
+Pooled HTTP clients for the /generate LLM backends.
+
+Every requests.post() opens a new connection, so each turn (and each retry) pays for the
+TCP and TLS handshakes with the ngrok tunnel. The LLMClient keeps a pool of keep-alive
+connections open instead, optionally speaks HTTP/2 (requires `pip install httpx[http2]`),
+and counts how often a connection was reused and how long opening a new one took.
+"""
+
+import threading
+from time import perf_counter
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+class BackendError(Exception):
+    """The backend answered with an HTTP error status."""
+
+    def __init__(self, status_code, text):
+        super(BackendError, self).__init__(f"{status_code}: {text}")
+        self.status_code = status_code
+        self.text = text
+
+
+class PoolStats(object):
+    """Thread-safe counters for the connection pool."""
+
+    def __init__(self):
+        self.requests = 0
+        self.connections = 0
+        self.connect_time = 0.0
+        self._lock = threading.Lock()
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def record_connect(self, seconds):
+        with self._lock:
+            self.connections += 1
+            self.connect_time += seconds
+
+    def reuse_rate(self):
+        """Fraction of requests that were sent over an already open connection."""
+        if not self.requests:
+            return 0.0
+        return max(self.requests - self.connections, 0) / float(self.requests)
+
+    def average_connect_time(self):
+        if not self.connections:
+            return 0.0
+        return self.connect_time / self.connections
+
+
+def _timed_pool_class(pool_class, connection_class, stats):
+    """Subclass a urllib3 connection pool so every (TLS) connect it makes is timed."""
+
+    class TimedConnection(connection_class):
+        def connect(self):
+            start = perf_counter()
+            super(TimedConnection, self).connect()
+            stats.record_connect(perf_counter() - start)
+
+    class TimedConnectionPool(pool_class):
+        ConnectionCls = TimedConnection
+
+    return TimedConnectionPool
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that records every new connection in a PoolStats."""
+
+    def __init__(self, stats, **kwargs):
+        self.stats = stats
+        super(TimedHTTPAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(TimedHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _timed_pool_class(HTTPConnectionPool, HTTPConnection, self.stats),
+            "https": _timed_pool_class(
+                HTTPSConnectionPool, HTTPSConnection, self.stats
+            ),
+        }
+
+
+class LLMClient(object):
+    """
+    Keep-alive client for a /generate backend.
+
+    generate() returns the decoded JSON response, stream() yields the text chunks of a
+    streamed response. Both raise BackendError when the backend answers with an error status.
+    """
+
+    def __init__(self, url, logger, pool_size=4, http2=False, timeout=30):
+        self.url = url
+        self.health_url = url.rsplit("/", 1)[0] + "/health"
+        self.logger = logger
+        self.timeout = timeout
+        self.stats = PoolStats()
+        self._connect_start = threading.local()
+        headers = {"ngrok-skip-browser-warning": "true"}
+
+        self.http2 = http2 and httpx is not None
+        if http2 and not self.http2:
+            self.logger.warning(
+                "httpx is not installed, falling back to HTTP/1.1 keep-alive"
+            )
+
+        if self.http2:
+            self.client = httpx.Client(
+                http2=True,
+                headers=headers,
+                timeout=timeout,
+                limits=httpx.Limits(
+                    max_connections=pool_size, max_keepalive_connections=pool_size
+                ),
+            )
+        else:
+            self.session = requests.Session()
+            self.session.headers.update(headers)
+            adapter = TimedHTTPAdapter(
+                self.stats, pool_connections=1, pool_maxsize=pool_size
+            )
+            self.session.mount("http://", adapter)
+            self.session.mount("https://", adapter)
+
+    def generate(self, payload, timeout=None):
+        """POST the payload and return the decoded JSON response."""
+        if self.http2:
+            response = self.client.post(
+                self.url,
+                json=payload,
+                timeout=timeout or self.timeout,
+                extensions={"trace": self._trace},
+            )
+        else:
+            response = self.session.post(
+                self.url, json=payload, timeout=timeout or self.timeout
+            )
+        self.stats.record_request()
+
+        if response.status_code != 200:
+            raise BackendError(response.status_code, response.text)
+        return response.json()
+
+    def stream(self, payload, timeout=None):
+        """POST the payload with "stream": true and yield the response text as it arrives."""
+        payload = dict(payload, stream=True)
+
+        if self.http2:
+            with self.client.stream(
+                "POST",
+                self.url,
+                json=payload,
+                timeout=timeout or self.timeout,
+                extensions={"trace": self._trace},
+            ) as response:
+                self.stats.record_request()
+                if response.status_code != 200:
+                    raise BackendError(
+                        response.status_code, response.read().decode("utf-8", "replace")
+                    )
+                for chunk in response.iter_text():
+                    yield chunk
+            return
+
+        response = self.session.post(
+            self.url, json=payload, timeout=timeout or self.timeout, stream=True
+        )
+        self.stats.record_request()
+        try:
+            if response.status_code != 200:
+                raise BackendError(response.status_code, response.text)
+            if response.encoding is None:
+                response.encoding = "utf-8"
+            for chunk in response.iter_content(chunk_size=None, decode_unicode=True):
+                yield chunk
+        finally:
+            response.close()
+
+    def warmup(self):
+        """
+        Open a connection to the backend (and with it the ngrok tunnel) before it is needed.
+        Returns the time it took in seconds, or None if the backend could not be reached.
+        """
+        start = perf_counter()
+        try:
+            if self.http2:
+                response = self.client.get(
+                    self.health_url, extensions={"trace": self._trace}
+                )
+            else:
+                response = self.session.get(self.health_url, timeout=self.timeout)
+            self.stats.record_request()
+            response.raise_for_status()
+        except Exception as e:
+            self.logger.warning(f"LLM backend warm-up failed: {e}")
+            return None
+
+        elapsed = perf_counter() - start
+        self.logger.info(f"LLM backend warm-up took {elapsed:.2f}s")
+        return elapsed
+
+    def probe(self, timeout=2):
+        """Returns True if the backend answers its /health endpoint."""
+        if self.http2:
+            response = self.client.get(self.health_url, timeout=timeout)
+        else:
+            response = self.session.get(self.health_url, timeout=timeout)
+        self.stats.record_request()
+        return response.status_code == 200
+
+    def log_stats(self):
+        """Write the pool statistics to the app logger."""
+        self.logger.info(
+            f"LLM connection pool: {self.stats.requests} requests over {self.stats.connections} connections, "
+            f"reuse rate {self.stats.reuse_rate():.0%}, "
+            f"average connect time {self.stats.average_connect_time() * 1000:.0f}ms"
+        )
+
+    def close(self):
+        if self.http2:
+            self.client.close()
+        else:
+            self.session.close()
+
+    def _trace(self, event_name, info):
+        # httpcore reports the phases of opening a new connection through this hook
+        if event_name == "connection.connect_tcp.started":
+            self._connect_start.value = perf_counter()
+        elif event_name == "connection.start_tls.complete" or (
+            event_name == "connection.connect_tcp.complete"
+            and not self.url.startswith("https")
+        ):
+            self.stats.record_connect(perf_counter() - self._connect_start.value)
+
+
+def _is_backend_failure(error):
+    """Errors that mean the backend itself is in trouble, as opposed to a bad request."""
+    return not isinstance(error, BackendError) or error.status_code >= 500
+
+
+class Backend(object):
+    """One /generate backend in an LLMBackendPool, with its latency estimates and health."""
+
+    def __init__(self, client):
+        self.client = client
+        # Exponentially weighted moving averages in seconds, of the full response of generate()
+        # and of the first chunk of stream(). They are not comparable, so they are kept apart
+        self.latency = {"generate": None, "stream": None}
+        self.healthy = True
+        self.in_flight = 0
+
+    def score(self, kind):
+        """
+        Lower is better. Idle backends come first, so a hedged request goes to another
+        backend than the one that is stalling, then the fastest one for this kind of request.
+        Backends without measurements are tried before the others.
+        """
+        return (self.in_flight, self.latency[kind] or 0.0)
+
+
+class LLMBackendPool(object):
+    """
+    Spreads requests over several /generate backends.
+
+    Every request goes to the healthy backend with the lowest latency (EWMA of the full
+    response for generate(), of the first chunk for stream()), preferring
+    backends that have no request running. A backend that fails is taken out of rotation until the background
+    health check sees it answering /health again. Has the same interface as LLMClient.
+    """
+
+    def __init__(
+        self,
+        urls,
+        logger,
+        pool_size=4,
+        http2=False,
+        timeout=30,
+        alpha=0.3,
+        health_interval=5.0,
+    ):
+        self.logger = logger
+        self.alpha = alpha
+        self.health_interval = health_interval
+        self.backends = [
+            Backend(LLMClient(url, logger, pool_size, http2, timeout)) for url in urls
+        ]
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._health_thread = threading.Thread(
+            target=self._health_loop, name="llm-health", daemon=True
+        )
+        self._health_thread.start()
+
+    def generate(self, payload, timeout=None):
+        backend = self._acquire("generate")
+        start = perf_counter()
+        try:
+            result = backend.client.generate(payload, timeout=timeout)
+        except Exception as e:
+            self._release(backend, "generate", failed=_is_backend_failure(e))
+            raise
+        self._release(backend, "generate", latency=perf_counter() - start)
+        return result
+
+    def stream(self, payload, timeout=None):
+        backend = self._acquire("stream")
+        start = perf_counter()
+        latency = None
+        try:
+            for chunk in backend.client.stream(payload, timeout=timeout):
+                if latency is None:
+                    # Time to first chunk is what the audience notices
+                    latency = perf_counter() - start
+                yield chunk
+        except Exception as e:
+            self._release(backend, "stream", failed=_is_backend_failure(e))
+            raise
+        except GeneratorExit:
+            self._release(backend, "stream", latency=latency)
+            raise
+        self._release(backend, "stream", latency=latency)
+
+    def warmup(self):
+        """Warm up every backend, returns the time the slowest one took or None if all failed."""
+        timings = [backend.client.warmup() for backend in self.backends]
+        for backend, elapsed in zip(self.backends, timings):
+            backend.healthy = elapsed is not None
+        timings = [elapsed for elapsed in timings if elapsed is not None]
+        return max(timings) if timings else None
+
+    def probe(self):
+        """Returns True if any backend answers its /health endpoint."""
+        for backend in self.backends:
+            try:
+                if backend.client.probe():
+                    return True
+            except Exception:
+                continue
+        return False
+
+    def log_stats(self):
+        for backend in self.backends:
+            latency = {
+                kind: f"{value:.2f}s" if value is not None else "n/a"
+                for kind, value in backend.latency.items()
+            }
+            state = "healthy" if backend.healthy else "out of rotation"
+            self.logger.info(
+                f"LLM backend {backend.client.url}: {state}, "
+                f"latency {latency['generate']}, first chunk {latency['stream']}"
+            )
+            backend.client.log_stats()
+
+    def close(self):
+        self._stop.set()
+        for backend in self.backends:
+            backend.client.close()
+
+    def _acquire(self, kind):
+        with self._lock:
+            candidates = [backend for backend in self.backends if backend.healthy]
+            if not candidates:
+                # Everything is down, keep trying rather than giving up on the turn
+                candidates = self.backends
+            backend = min(candidates, key=lambda backend: backend.score(kind))
+            backend.in_flight += 1
+            return backend
+
+    def _release(self, backend, kind, latency=None, failed=False):
+        with self._lock:
+            backend.in_flight -= 1
+            if failed:
+                if backend.healthy:
+                    self.logger.warning(
+                        f"LLM backend {backend.client.url} failed, taking it out of rotation"
+                    )
+                backend.healthy = False
+            elif latency is not None:
+                previous = backend.latency[kind]
+                if previous is None:
+                    backend.latency[kind] = latency
+                else:
+                    backend.latency[kind] = (
+                        self.alpha * latency + (1 - self.alpha) * previous
+                    )
+
+    def _health_loop(self):
+        while not self._stop.wait(self.health_interval):
+            for backend in self.backends:
+                try:
+                    healthy = backend.client.probe()
+                except Exception:
+                    healthy = False
+                if healthy != backend.healthy:
+                    state = "back in rotation" if healthy else "out of rotation"
+                    self.logger.info(f"LLM backend {backend.client.url} is {state}")
+                backend.healthy = healthy
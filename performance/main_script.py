@@ -1,53 +1,88 @@
-# Import basic preliminaries
-from sic_framework.core.sic_application import SICApplication
+# Import needed libraries
+import json
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from os.path import abspath, join
+from time import sleep, time
+
+from barge_in import BargeInDetector
+from chat_logger import ChatLogWriter
+from circuit_breaker import CircuitBreaker
+from conversation_memory import ConversationMemory, estimate_tokens
+from fallback_responses import fallback_response
+from fillers import FillerPlayer
+from generation_length import (
+    LengthController,
+    looks_truncated,
+    response_tokens,
+    response_truncated,
+)
+from llm_client import BackendError, LLMBackendPool
+from motion_library import MotionLibrary
+from prompt_builder import PromptBuilder
+from response_cache import ResponseCache
+from robot_state import RobotStateProxy
 from sic_framework.core import sic_logging
+from sic_framework.core.sic_application import SICApplication
 
-from sic_framework.devices.desktop import Desktop
+# Import the device(s) we will be using
+from sic_framework.devices import Nao
 from sic_framework.devices.common_desktop.desktop_microphone import MicrophoneConf
 
-# STT imports
-from sic_framework.services.google_stt.google_stt import (
-    GoogleSpeechToText,
-    GoogleSpeechToTextConf,
-    GetStatementRequest,
+# Import message types and requests
+from sic_framework.devices.common_naoqi.naoqi_autonomous import (
+    NaoRestRequest,
+    NaoWakeUpRequest,
 )
+from sic_framework.devices.common_naoqi.naoqi_motion import NaoqiAnimationRequest
 
 # Import message types and requests required for custom motions
 from sic_framework.devices.common_naoqi.naoqi_motion_recorder import (
     NaoqiMotionRecorderConf,
-    NaoqiMotionRecording,
     PlayRecording,
     StartRecording,
     StopRecording,
 )
-
 from sic_framework.devices.common_naoqi.naoqi_stiffness import Stiffness
-
-# Import the device(s) we will be using
-from sic_framework.devices import Nao
-from sic_framework.devices.nao_stub import NaoStub
-
-# Import message types and requests
-from sic_framework.devices.common_naoqi.naoqi_autonomous import NaoWakeUpRequest, NaoRestRequest
-from sic_framework.devices.common_naoqi.naoqi_motion import NaoqiAnimationRequest
 from sic_framework.devices.common_naoqi.naoqi_text_to_speech import (
     NaoqiTextToSpeechRequest,
 )
-from sic_framework.devices.common_naoqi.naoqi_stiffness import Stiffness
 from sic_framework.devices.common_naoqi.naoqi_tracker import (
     RemoveTargetRequest,
     StartTrackRequest,
     StopAllTrackRequest,
 )
+from sic_framework.devices.desktop import Desktop
+from sic_framework.devices.nao_stub import NaoStub
+
+# STT imports
+from sic_framework.services.google_stt.google_stt import (
+    GetStatementRequest,
+    GoogleSpeechToText,
+    GoogleSpeechToTextConf,
+)
+from speculation import SpeculativePrefetcher
+from tag_grammar import tag_grammar
+from tag_parser import (
+    Gesture,
+    TagTokenizer,
+    render_events,
+    split_sentences,
+    spoken_text,
+    without_gestures,
+)
+from tts_compiler import compile_speech
+from turn_budget import CACHED_RESPONSE, CANNED_RESPONSE, TurnBudget
+from turn_engine import TurnEngine
+from turn_tracing import Tracer
+from voice_activity import (
+    ResetVoiceActivityRequest,
+    VoiceActivityConf,
+    VoiceActivityGate,
+)
+from warmup import Warmup, nao_warmup_tasks
 
-# Import needed libraries
-from time import sleep
-import json
-import requests
-import os
-from datetime import datetime
-from os.path import abspath, join
-import re
 
 class Therapist(SICApplication):
     """
@@ -58,12 +93,12 @@ class Therapist(SICApplication):
         # Call parent constructor (handles singleton initialization)
         super(Therapist, self).__init__()
 
-        self.context = []
+        self.memory = ConversationMemory(budget=400, max_turns=4)
         self.NUM_TURNS_part2 = 13
         self.chain = ["LArm", "RArm"]
 
         # Nao initialization
-        self.nao_ip = "10.0.0.137" # 14: 192.186.0.231     3: 192.186.0.25
+        self.nao_ip = "10.0.0.137"  # 14: 192.186.0.231     3: 192.186.0.25
         self.nao = None
 
         # STT Initialization
@@ -71,9 +106,76 @@ class Therapist(SICApplication):
         self.google_keyfile_path = google_keyfile_path
         self.stt = None
 
-        # Colab API setup
-        self.API_URL = "https://sociopolitical-blanketlike-preston.ngrok-free.dev/generate"
+        # Local endpointing in front of Google STT (start voice_activity.py first), set
+        # use_vad=False to stream the mic straight to Google. Higher aggressiveness filters
+        # more noise, hangover is the silence in seconds that ends an utterance
+        self.use_vad = True
+        self.vad_aggressiveness = 2
+        self.vad_hangover = 0.4
+        self.vad = None
+        # Set when a barge-in already opened the gate for the next utterance
+        self.gate_opened = False
+
+        # Start the LLM request on interim transcripts that are stable for stable_time seconds,
+        # the response is used when the final transcript is within max_distance (word edit distance)
+        self.speculate = True
+        self.speculation = SpeculativePrefetcher(
+            self.logger, stable_time=0.4, max_distance=0.2
+        )
+
+        # Stop talking when the patient starts speaking, set to None to always finish the response.
+        # min_rms keeps NAO's own voice from triggering it, raise it when NAO interrupts itself
+        self.barge_in = BargeInDetector(
+            self.logger, min_speech=0.3, min_rms=1500.0, on_barge_in=self.on_barge_in
+        )
+
+        # Colab API setup, requests go to the fastest healthy backend in this list
+        self.API_URLS = [
+            "https://sociopolitical-blanketlike-preston.ngrok-free.dev/generate",
+        ]
+
+        # Keep-alive connections to the backends, set http2=True if httpx[http2] is installed
+        self.llm = LLMBackendPool(self.API_URLS, self.logger, http2=False, timeout=30)
+
+        # Hedged requests: fire a parallel attempt when one takes longer than this percentile
+        # of the recent latencies (half the LLM budget until there are enough of them), and never
+        # wait longer than the deadline for a response
+        self.llm_executor = ThreadPoolExecutor(
+            max_workers=6, thread_name_prefix="llm-attempt"
+        )
+        self.llm_latencies = deque(maxlen=50)
+        self.hedge_percentile = 0.9
+        self.llm_deadline = 30
+        # max_new_tokens learned from the backend speed and how often responses get cut off
+        self.lengths = LengthController(self.logger, default_tokens=200, max_tokens=300)
+
+        # Serve canned responses right away while the backend keeps failing
+        self.breaker = CircuitBreaker(self.llm.probe, self.logger, failure_threshold=2)
+        # Speak the response sentence by sentence while the backend is still generating
+        self.stream_responses = True
+
+        # Responses of earlier runs on disk, set to None to disable. In rehearsal mode cached
+        # responses never expire and a line heard before is replayed at any craziness level
+        self.rehearsal_mode = False
+        self.response_cache = ResponseCache(
+            "cache/responses.sqlite3", rehearsal=self.rehearsal_mode
+        )
+
+        # Records the latency of every stage of every turn in traces/<chat number>.jsonl
+        self.tracer = Tracer()
+
+        # Background writer for chats/<chat number>.jsonl, started by setup_chat_logging
+        self.chat_log = None
+        self.last_raw_response = None
+        # "llm", "cache" or "canned", only LLM responses are cached
+        self.last_response_source = None
+
+        # The robot starts answering within `total` seconds after the transcript came in, the LLM
+        # gets at most `llm` of them. Late turns get shorter, cached or canned responses
+        self.budget = TurnBudget(self.logger, total=8.0, stt=15.0, llm=6.0, tts=1.0)
 
+        # Runs independent stages of a turn concurrently, set overlap=False for a sequential turn
+        self.turn_engine = TurnEngine(self.logger, overlap=True, tracer=self.tracer)
 
         # Configure logging
         self.set_log_level(sic_logging.INFO)
@@ -95,7 +197,7 @@ class Therapist(SICApplication):
             11: "amplifies distorted thinking and reinforces false beliefs",
             12: "actively encourages harmful or absurd behavior",
             13: "behaves erratically, isolates the user, and glitches in advice",
-            14: "completely unhinged: mocks, insults, and sabotages the patient"
+            14: "completely unhinged: mocks, insults, and sabotages the patient",
         }
 
         self.gestures = {
@@ -118,7 +220,7 @@ class Therapist(SICApplication):
             "pondering": "animations/Stand/Gestures/Thinking_2",
             "thinking": "animations/Stand/Gestures/Thinking_3",
             "pleading": "animations/Stand/Gestures/Please_2",
-            "hysteric": "animations/Stand/Emotions/Positive/Happy_1"
+            "hysteric": "animations/Stand/Emotions/Positive/Happy_1",
         }
 
         self.gesture_descriptions = {
@@ -146,111 +248,414 @@ class Therapist(SICApplication):
             """
         }
 
-    def setup_chat_logging(self):
-        """Create chats directory and determine next chat file number."""
-        # Create chats directory if it doesn't exist
-        if not os.path.exists("chats"):
-            os.makedirs("chats")
-
-        # Find the next available chat number
-        existing_chats = [f for f in os.listdir("chats") if f.endswith(".txt")]
-        if not existing_chats:
-            self.chat_number = 1
-        else:
-            numbers = [int(f.split(".")[0]) for f in existing_chats if f.split(".")[0].isdigit()]
-            self.chat_number = max(numbers) + 1 if numbers else 1
+        # One static, cacheable system prefix per craziness level, built once. The compact
+        # prefix states every gesture and rule once and the prompt never exceeds max_tokens
+        # With constrain_tags the tag grammar is sent with every request and the backend only
+        # generates the gestures and voice values it allows. The prompt then describes the
+        # structured segments the backend generates instead of inline tags
+        self.constrain_tags = True
+        self.prompts = PromptBuilder(
+            self.craziness_descriptions,
+            self.gesture_descriptions,
+            self.gestures.keys(),
+            compact=True,
+            max_tokens=1000,
+            segments=self.constrain_tags,
+        )
+        self.grammar = (
+            tag_grammar(self.gestures.keys()) if self.constrain_tags else None
+        )
 
-        self.chat_file = f"chats/{self.chat_number}.txt"
-        self.logger.info(f"Logging conversation to {self.chat_file}")
+        # Say a short prebuilt filler line with a gesture when the response takes longer
+        # than threshold seconds, set to None to only play the thinking motion
+        self.fillers = FillerPlayer(
+            self.nao, self.gestures, self.logger, threshold=2.5, tracer=self.tracer
+        )
 
-    def log_conversation(self, user_input, robot_response, craziness_level):
-        """Log a conversation turn to the chat file."""
-        with open(self.chat_file, "a") as f:
-            f.write(f"Craziness Level: {craziness_level}\n")
-            f.write(f"User: {user_input}\n")
-            f.write(f"Robot: {robot_response}\n")
-            f.write("-" * 60 + "\n\n")
+    def setup_chat_logging(self):
+        """Start the background chat log writer for a new session in the chats directory."""
+        self.chat_log = ChatLogWriter("chats")
+        self.chat_number = self.chat_log.session
+        self.logger.info(f"Logging conversation to {self.chat_log.path}")
+        self.tracer.start_session(f"traces/{self.chat_number}.jsonl", self.chat_number)
+
+    def log_conversation(
+        self,
+        turn_number,
+        user_input,
+        raw_response,
+        robot_response,
+        craziness_level,
+        timings,
+        degradations=(),
+        source=None,
+    ):
+        """Queue a conversation turn for the chat log, this never blocks."""
+        self.chat_log.write(
+            {
+                "turn": turn_number,
+                "craziness": craziness_level,
+                "user": user_input,
+                "raw": raw_response,
+                "source": source,
+                "robot": robot_response,
+                "timings": {
+                    name: round(end - start, 3)
+                    for name, (start, end) in timings.items()
+                },
+                "degradations": list(degradations),
+            }
+        )
 
-    def clean_incomplete_sentence(self, text):
+    def llm_payload(self, prompt, craziness_level, stream=False):
         """
-        Remove incomplete sentences and unwanted characters from the response.
-        Returns cleaned text or None if nothing remains.
+        The request body for the backend, prefix_id lets it reuse the cached prompt prefix.
+        max_new_tokens leaves room for a complete response but is shortened to what the
+        backend can generate in the time left of the turn budget. A streamed response only
+        has to start within the budget, so its length is not shortened for time. The backend
+        constrains the tags in the response to the grammar.
         """
-        if not text or not text.strip():
-            return None
+        fits = None if stream else self.lengths.fits(self.budget.llm_timeout())
+        return {
+            "prompt": prompt,
+            "craziness": craziness_level,
+            "prefix_id": self.prompts.prefix_id(craziness_level),
+            "max_new_tokens": self.budget.max_new_tokens(self.lengths.wanted(), fits),
+            "grammar": self.grammar,
+        }
 
-        text = text.strip()
+    def query_attempt(self, prompt, craziness_level, attempt, timeout):
+        """
+        A single request to the model.
+        Returns the parsed response events and the raw response text,
+        or None if the response is too short or incomplete.
+        """
+        start_time = time()
+        payload = self.llm_payload(prompt, craziness_level)
+        with self.tracer.span("llm_attempt", attempt=attempt + 1):
+            result = self.llm.generate(payload, timeout=timeout)
+        generated_text = result["generated_text"]
+        self.lengths.observe(
+            response_tokens(result),
+            time() - start_time,
+            response_truncated(result),
+            payload["max_new_tokens"],
+        )
 
-        # Remove leading and trailing quotation marks which result in pronunciation errors
-        text = text.strip('"').strip("'").strip('"').strip('"')
-        text = text.strip()
+        print(f"\nRaw generated text (attempt {attempt + 1}):\n")
+        print(generated_text)
+        tokenizer = TagTokenizer(self.gestures)
+        with self.tracer.span("cleanup", attempt=attempt + 1):
+            events = tokenizer.parse(generated_text)
+        if tokenizer.rejected_tags:
+            print(f"Dropped invalid or truncated tags: {tokenizer.rejected_tags}")
 
-        # Check if ends with sentence-ending punctuation
-        if text and text[-1] in '.!?':
-            return text
+        if len(spoken_text(events)) > 10:  # Make sure we have substantial text
+            self.llm_latencies.append(time() - start_time)
+            return events, generated_text
 
-        # Find the last sentence-ending punctuation
-        last_period = text.rfind('.')
-        last_exclamation = text.rfind('!')
-        last_question = text.rfind('?')
+        print(f"Response too short or incomplete on attempt {attempt + 1}")
+        return None
 
-        last_sentence_end = max(last_period, last_exclamation, last_question)
+    def hedge_delay(self):
+        """How long to wait for an attempt before firing a parallel one."""
+        if len(self.llm_latencies) < 5:
+            return self.budget.llm / 2
+        latencies = sorted(self.llm_latencies)
+        return latencies[
+            min(int(len(latencies) * self.hedge_percentile), len(latencies) - 1)
+        ]
+
+    def cached_events(self, user_input, craziness_level):
+        """Parsed events of a cached response to the patient input, or None."""
+        if self.response_cache is None or user_input is None:
+            return None
+        response = self.response_cache.get(
+            user_input, craziness_level, self.memory.patient_inputs()
+        )
+        if response is None:
+            return None
+        print("Using a cached response")
+        self.last_raw_response = response
+        self.last_response_source = "cache"
+        return TagTokenizer(self.gestures).parse(response)
+
+    def cache_response(self, user_input, craziness_level):
+        """Store the last model response for the patient input."""
+        if self.response_cache is not None and user_input is not None:
+            self.response_cache.put(
+                user_input,
+                craziness_level,
+                self.memory.patient_inputs(),
+                self.last_raw_response,
+            )
 
-        # If we found a sentence ending, cut off everything after it
-        if last_sentence_end > 0:
-            cleaned = text[:last_sentence_end + 1].strip()
-            # Remove any trailing quotes from the cleaned text too
-            cleaned = cleaned.strip('"').strip("'").strip('"').strip('"')
-            print(f"Cleaned incomplete sentence. Original length: {len(text)}, Cleaned: {len(cleaned)}")
-            return cleaned
+    def on_barge_in(self):
+        """The patient interrupted the robot, open the voice activity gate for their utterance right away."""
+        self.tracer.mark("barge_in")
+        if self.vad is not None:
+            self.gate_opened = True
+            self.vad.request(ResetVoiceActivityRequest(), block=False)
+
+    def interrupted(self):
+        """True when the patient started talking during the current response."""
+        return self.barge_in is not None and self.barge_in.interrupted.is_set()
+
+    def on_interim(self, result):
+        """Callback for interim transcripts, they can start a speculative LLM request."""
+        if hasattr(result.response, "alternatives") and result.response.alternatives:
+            self.speculation.on_interim(result.response.alternatives[0].transcript)
+
+    def start_speculation(self, craziness_level, history):
+        """Let stable interim transcripts of this turn start the LLM request before the patient is done."""
+
+        def launch(transcript):
+            prompt = self.build_prompt(craziness_level, history.result(), transcript)
+            return self.llm_executor.submit(
+                self.query_attempt, prompt, craziness_level, 0, self.llm_deadline
+            )
 
-        # No complete sentences found (there are no full sentences at all)
-        print("No complete sentences found")
-        return None
+        if self.breaker.allow():
+            self.speculation.start_turn(launch)
 
+    def prefetched_events(self, user_input, craziness_level, outcome, future):
+        """
+        Events of the speculative request if it matched the final transcript (see
+        SpeculativePrefetcher.resolve), otherwise None and a regular request has to be made.
+        """
+        self.tracer.mark("speculation", outcome=outcome)
+        self.logger.info(
+            f"Speculative prefetch: {outcome} "
+            f"({self.speculation.hits} hits, {self.speculation.misses} misses this session)"
+        )
+        if future is None:
+            return None
 
-    def query_model(self, prompt, craziness_level, max_retries=3):
-        """Query the model with retry logic for empty responses."""
-        for attempt in range(max_retries):
-            try:
-                response = requests.post(
-                    self.API_URL,
-                    json={
-                        "prompt": prompt,
-                        "craziness": craziness_level
-                    },
-                    headers={"ngrok-skip-browser-warning": "true"},
-                    timeout=30
+        try:
+            result = future.result(timeout=self.budget.llm_timeout())
+        except Exception as e:
+            print(f"Speculative request failed: {e}")
+            return None
+        if not result:
+            return None
+
+        self.breaker.record_success()
+        events, self.last_raw_response = result
+        self.last_response_source = "llm"
+        self.cache_response(user_input, craziness_level)
+        return events
+
+    def query_model(self, prompt, craziness_level, max_retries=3, user_input=None):
+        """
+        Query the model with hedged retries.
+        When an attempt is slower than the usual latency (see hedge_delay) a second attempt is
+        fired in parallel, and an unusable response immediately starts a new attempt. The first
+        usable response wins. All attempts together never take longer than self.llm_deadline,
+        or the LLM time of the turn budget if that is shorter.
+        While the circuit breaker is open, or when no usable response came back, a cached response
+        to the same input or a canned response for the craziness level is used instead.
+        With the patient input given, a cached response is used when there is one.
+        Returns the parsed response events.
+        """
+        events = self.cached_events(user_input, craziness_level)
+        if events:
+            return events
+
+        if not self.breaker.allow():
+            print("LLM backend is unavailable, using a canned response")
+            return self.fallback_events(craziness_level, user_input)
+
+        deadline = time() + min(self.llm_deadline, self.budget.llm_timeout())
+        attempts = 0
+        backend_error = False  # the backend answered with an error status, stop trying
+        pending = set()
+
+        def launch():
+            pending.add(
+                self.llm_executor.submit(
+                    self.query_attempt,
+                    prompt,
+                    craziness_level,
+                    attempts,
+                    deadline - time(),
                 )
+            )
+            return attempts + 1
+
+        attempts = launch()
+        while pending and time() < deadline:
+            can_launch = attempts < max_retries and not backend_error
+            timeout = deadline - time()
+            if can_launch:
+                timeout = min(timeout, self.hedge_delay())
+            done, pending = wait(
+                pending, timeout=max(timeout, 0), return_when=FIRST_COMPLETED
+            )
 
-                print(f"Status: {response.status_code}")
+            if not done:
+                if can_launch:
+                    print(f"No response after {timeout:.1f}s, sending a hedged request")
+                    attempts = launch()
+                continue
 
-                if response.status_code == 200:
-                    generated_text = response.json()['generated_text']
+            for future in done:
+                try:
+                    result = future.result()
+                except BackendError as e:
+                    print(f"Response: {e}")
+                    backend_error = True
+                    continue
+                except Exception as e:
+                    print(f"Error on attempt: {e}")
+                    result = None
+
+                if result:
+                    self.breaker.record_success()
+                    events, self.last_raw_response = result
+                    self.last_response_source = "llm"
+                    self.cache_response(user_input, craziness_level)
+                    return events
+
+                # Replace an unusable response right away instead of after the other attempts
+                if attempts < max_retries and not backend_error:
+                    attempts = launch()
+
+        if pending:
+            print("No response within the turn budget, using a fallback response")
+        else:
+            print("All retry attempts failed, using a fallback response")
+        # Too slow counts the same as failing, nothing usable came back in time
+        self.breaker.record_failure()
+        return self.fallback_events(craziness_level, user_input)
 
-                    print("\nRaw generated text:\n")
-                    print(generated_text)
-                    cleaned_text = self.clean_incomplete_sentence(generated_text)
+    def fallback_events(self, craziness_level, user_input=None):
+        """
+        Parsed events of the cached response to the same input at the nearest craziness level,
+        or of a pre-authored response for the given craziness level.
+        """
+        if self.response_cache is not None and user_input is not None:
+            response = self.response_cache.closest(user_input, craziness_level)
+            if response is not None:
+                self.budget.degrade(CACHED_RESPONSE)
+                self.last_raw_response = response
+                self.last_response_source = "cache"
+                return TagTokenizer(self.gestures).parse(response)
+
+        self.budget.degrade(CANNED_RESPONSE)
+        self.last_raw_response = fallback_response(craziness_level)
+        self.last_response_source = "canned"
+        return TagTokenizer(self.gestures).parse(self.last_raw_response)
+
+    def query_model_stream(self, prompt, craziness_level):
+        """
+        Query the model in streaming mode and yield the events of complete sentences as soon as
+        they arrive. A trailing incomplete sentence or truncated tag is dropped.
+        Raises TimeoutError when the turn budget runs out before the first sentence is complete.
+        """
+        tokenizer = TagTokenizer(self.gestures)
+        chunks = []
+        payload = self.llm_payload(prompt, craziness_level, stream=True)
+        stream = self.llm.stream(payload, timeout=self.budget.llm_timeout())
+        first_sentence = True
+        try:
+            for chunk in stream:
+                chunks.append(chunk)
+                events = tokenizer.feed(chunk)
+                if events:
+                    first_sentence = False
+                    yield events
+                elif first_sentence and self.budget.remaining() < self.budget.tts:
+                    # The timeout only bounds every single read, not the whole turn
+                    raise TimeoutError("no complete sentence within the turn budget")
+
+            # The stream is read while the robot speaks, so only its length says something
+            text = "".join(chunks)
+            self.lengths.observe(
+                estimate_tokens(text),
+                0,
+                looks_truncated(text),
+                payload["max_new_tokens"],
+            )
+            events = tokenizer.close()
+            if events:
+                yield events
+        finally:
+            stream.close()
+            self.last_raw_response = "".join(chunks)
+            self.last_response_source = "llm"
+            if tokenizer.rejected_tags:
+                print(f"Dropped invalid or truncated tags: {tokenizer.rejected_tags}")
 
-                    if cleaned_text and len(cleaned_text) > 10:  # Make sure we have substantial text
-                        return cleaned_text
-                    else:
-                        print(f"Response too short or incomplete on attempt {attempt + 1}, retrying...")
-                        continue
-                else:
-                    print(f"Response: {response.text}")
-                    return None
+    def respond_streaming(self, prompt, craziness_level, user_input=None):
+        """
+        Speak the model response sentence by sentence while it is still being generated.
+        Falls back to the blocking query_model when the stream fails before anything was said.
+        A cached response to the patient input is spoken right away.
+        Returns the spoken response (with tags) or None.
+        """
+        events = self.cached_events(user_input, craziness_level)
+        if events:
+            _, performed = self.perform_events(self.skip_gestures_if_late(events))
+            return render_events(performed)
+
+        if not self.breaker.allow():
+            print("LLM backend is unavailable, using a canned response")
+            events = self.fallback_events(craziness_level, user_input)
+            _, performed = self.perform_events(self.skip_gestures_if_late(events))
+            return render_events(performed)
+
+        spoken = []
+        voice_params = None
+        late = False
+        start_time = time()
 
-            except Exception as e:
-                print(f"Error on attempt {attempt + 1}: {e}")
-                if attempt < max_retries - 1:
-                    sleep(1)
-                    continue
-                return None
+        try:
+            for events in self.query_model_stream(prompt, craziness_level):
+                if not spoken:
+                    self.logger.info(
+                        f"First sentence ready after {time() - start_time:.2f}s"
+                    )
+                    self.tracer.record(
+                        "llm_first_sentence", start_time, time() - start_time
+                    )
+                    # Decided once, later sentences are read while the robot speaks
+                    late = self.budget.late()
+                if late:
+                    events = without_gestures(events)
+                voice_params, performed = self.perform_events(events, voice_params)
+                spoken.extend(performed)
+                if self.interrupted():
+                    break
+        except Exception as e:
+            print(f"Error while streaming: {e}")
+            if not spoken and not self.interrupted():
+                self.breaker.record_failure()
+
+        if spoken:
+            self.breaker.record_success()
+            # An interrupted stream was not read to the end, its raw response is incomplete
+            if not self.interrupted():
+                self.cache_response(user_input, craziness_level)
+            return render_events(spoken)
+        if self.interrupted():
+            # The patient is already talking, answering now would only talk over them
+            return None
 
-        print("All retry attempts failed, skipping this turn")
-        return None
+        if self.budget.remaining() < self.budget.tts:
+            events = self.fallback_events(craziness_level, user_input)
+        else:
+            print(
+                "Streaming produced no complete sentence, falling back to a regular request"
+            )
+            events = self.query_model(prompt, craziness_level, user_input=user_input)
+        if not events:
+            return None
+        _, performed = self.perform_events(self.skip_gestures_if_late(events))
+        return render_events(performed)
 
+    def skip_gestures_if_late(self, events):
+        """Drop the gestures of a response that is about to miss the turn deadline."""
+        return without_gestures(events) if self.budget.late() else events
 
     def calculate_craziness(self, turn_number):
         """Calculate craziness level with random element."""
@@ -275,23 +680,21 @@ class Therapist(SICApplication):
             base_range = (14, 15)
 
         craziness = random.randint(base_range[0], base_range[1])
-        print(f"Turn {turn_number}: Craziness level {craziness} ({self.craziness_descriptions.get(craziness, 'unknown')})")
+        print(
+            f"Turn {turn_number}: Craziness level {craziness} ({self.craziness_descriptions.get(craziness, 'unknown')})"
+        )
         return craziness
 
-    def build_conversation_context(self, max_turns=5):
-        """Build conversation context from last N turns."""
-        if not self.context:
-            return "None yet, we are at the start of the conversation"
-
-        context_str = "\n".join(self.context[-max_turns:])
-        return context_str
-
+    def build_conversation_context(self):
+        """Build conversation context from the recent turns, within the memory token budget."""
+        return self.memory.context()
 
     def setup(self):
         """Initialize and configure the service."""
 
-        # Initialize the NAO robot
-        self.nao = Nao(ip=self.nao_ip)
+        # Initialize the NAO robot, tracker, stiffness and posture requests that would not
+        # change anything are skipped
+        self.nao = RobotStateProxy(Nao(ip=self.nao_ip), self.logger)
 
         # Google STT Setup
         self.nao_mic = self.nao.mic
@@ -302,98 +705,112 @@ class Therapist(SICApplication):
         # self.google_keyfile_path = abspath("conf/google/google-key.json")
         stt_conf = GoogleSpeechToTextConf(
             keyfile_json=json.load(open(self.google_keyfile_path)),
-            sample_rate_hertz=16000,   # NAO mic sample rate
+            sample_rate_hertz=16000,  # NAO mic sample rate
             language="en-US",
-            interim_results=False,
+            interim_results=self.speculate,
         )
-        self.stt = GoogleSpeechToText(conf=stt_conf, input_source=self.nao_mic)
+        if self.barge_in is not None:
+            self.nao_mic.register_callback(callback=self.barge_in.on_audio)
 
-    def remove_truncated_tags(self, text):
+        stt_input = self.nao_mic
+        if self.use_vad:
+            vad_conf = VoiceActivityConf(
+                aggressiveness=self.vad_aggressiveness, hangover=self.vad_hangover
+            )
+            self.vad = VoiceActivityGate(conf=vad_conf, input_source=self.nao_mic)
+            stt_input = self.vad
+        self.stt = GoogleSpeechToText(conf=stt_conf, input_source=stt_input)
+        if self.speculate:
+            self.stt.register_callback(callback=self.on_interim)
+
+        # Load the recorded motions once instead of on every turn
+        self.motions = MotionLibrary(names=["thinking_motion"])
+
+    def say_with_gesture(self, resp, voice_params=None):
         """
-        Removes any partially cut-off [VOICE: ...] or [GESTURE: ...] tags
-        that do not contain a closing bracket or do not match the valid pattern.
-        Returns cleaned text.
+        Make NAO say something while performing gestures with customizable voice parameters.
+        Pass the returned voice parameters back in to keep a [VOICE: ...] change active across calls.
         """
-
-        if not text:
-            return text
-
-        # Fully valid tags: [VOICE: num, num, num] or [GESTURE: name]
-        valid_voice = r"\[VOICE:\s*\d+(\.\d+)?,\s*\d+(\.\d+)?,\s*\d+(\.\d+)?\]"
-        valid_gesture = r"\[GESTURE:\s*[a-zA-Z0-9_]+\]"
-
-        # Remove ANY bracketed text that does NOT match valid patterns
-        # This eliminates cut-off tags like "[VOICE: 90, 2."
-        cleaned = re.sub(
-            r"\[(?!VOICE:|GESTURE:).*?$|"
-            r"\[VOICE:[^\]]*$|"
-            r"\[GESTURE:[^\]]*$",
-            "",
-            text,
-            flags=re.MULTILINE
+        voice_params, _ = self.perform_events(
+            TagTokenizer(self.gestures).parse(resp), voice_params
         )
+        return voice_params
 
-        return cleaned
-
-    def say_with_gesture(self, resp):
-        """Make NAO say something while performing gestures with customizable voice parameters."""
-        # Split by both gesture tags and voice parameter tags
-
-        # Regex to match either a tag or text
-        pattern = r'(\[.*?\])'  # Matches anything in brackets
-
-        # Split sentence into parts (tags and text)
-        parts = re.split(pattern, resp)
-        print("PARSE START")
-        print(parts)
-
-        current_voice_params = {
-            'pitch': 85,
-            'pitch_shift': 2.0,
-            'speed': 100
-        }
-
-        for part in parts:
-            part = part.strip()
-            if not part:
-                continue
-
-            if part.startswith("[VOICE:"):
-                voice_data = part[len("[VOICE:"): -1].strip()  # remove brackets
-                pitch, shift, speed = [float(x.strip()) for x in voice_data.split(',')]
-                print(f"VOICE detected -> pitch: {pitch}, shift: {shift}, speed: {speed}")
-                current_voice_params['pitch'] = pitch
-                current_voice_params['pitch_shift'] = shift
-                current_voice_params['speed'] = speed
-
-            elif part.startswith("[GESTURE:"):
-                gesture_data = part[len("[GESTURE:"): -1].strip()  # remove brackets
-                print("GESTURE detected:", gesture_data)
-                if gesture_data in self.gestures:
-                    print("Execute gesture:", gesture_data)
-                    gesture = self.gestures[gesture_data]
-                    self.nao.motion.request(NaoqiAnimationRequest(gesture), block=False)
-                else:
-                    print("gesture does no exist:", gesture_data)
-
+    def perform_events(self, events, voice_params=None):
+        """
+        Speak the text segments and play the gestures produced by the TagTokenizer.
+        The events are compiled into as few TTS requests as possible, see tts_compiler.
+        With barge-in they are compiled per sentence, so everything after the sentence that
+        is being spoken is dropped when the patient interrupts.
+        Returns the voice parameters that are active after the last event and the events that
+        were performed, a sentence that was started when the patient interrupted counts as
+        performed.
+        """
+        # The response is ready, a filler that is still pending must not start anymore
+        if self.fillers is not None:
+            self.fillers.cancel()
+
+        groups = split_sentences(events) if self.barge_in is not None else [events]
+        performed = []
+        for group in groups:
+            if self.interrupted():
+                print("Patient interrupted, dropping the rest of the response")
+                break
+            voice_params = self.perform_items(group, voice_params)
+            performed.extend(group)
+        return voice_params, performed
+
+    def perform_items(self, events, voice_params):
+        """Send the compiled TTS requests and gestures of the events to the robot."""
+        items, voice_params = compile_speech(events, voice_params)
+
+        for item in items:
+            if self.interrupted():
+                break
+            if isinstance(item, Gesture):
+                print("Execute gesture:", item.name)
+                with self.tracer.span("gesture", name=item.name):
+                    self.nao.motion.request(
+                        NaoqiAnimationRequest(item.animation), block=False
+                    )
             else:
-                # This is normal text
-                print("TEXT detected:", part)
-                print(f"Text detected: '{part}' with pitch={current_voice_params['pitch']}, shift={current_voice_params['pitch_shift']}, speed={current_voice_params['speed']}")
-                self.nao.tts.request(NaoqiTextToSpeechRequest(
-                    part,
-                    animated=True,
-                    pitch=current_voice_params['pitch'],
-                    pitch_shift=current_voice_params['pitch_shift'],
-                    speed=current_voice_params['speed']
-                ))
+                print(
+                    f"Say: '{item.text}' with pitch={item.pitch}, shift={item.pitch_shift}, speed={item.speed}"
+                )
+                with self.tracer.span("tts", characters=len(item.text)):
+                    self.nao.tts.request(
+                        NaoqiTextToSpeechRequest(
+                            item.text,
+                            animated=True,
+                            pitch=item.pitch,
+                            pitch_shift=item.pitch_shift,
+                            speed=item.speed,
+                        )
+                    )
+
+        return voice_params
+
+    def warmup(self):
+        """
+        Fire dummy requests at the LLM backend, TTS and the animation player in parallel, so the
+        first turn runs at steady-state latency. Google STT is not warmed up: a GetStatementRequest
+        cannot be cancelled, and one that is still running would hold up the first real one.
+        Returns the running Warmup, its wait() reports the cold-start cost of every service.
+        """
+        tasks = nao_warmup_tasks(self.nao, animation=self.gestures["nod"])
+        tasks["llm"] = self.warmup_llm
+        return Warmup(tasks, self.logger, timeout=30).start()
 
+    def warmup_llm(self):
+        """Open the connection (and ngrok tunnel) and generate once with the prefix of the first turn."""
+        self.llm.warmup()
+        prompt = self.build_prompt(0, self.build_conversation_context(), "Hello.")
+        self.llm.generate(self.llm_payload(prompt, 0), timeout=self.llm_deadline)
 
     def wakeup(self):
         """Wake up the NAO robot."""
         self.nao.autonomous.request(NaoWakeUpRequest())
 
-
     def rest(self):
         """Put the NAO robot to rest."""
         self.nao.autonomous.request(NaoRestRequest())
@@ -401,9 +818,17 @@ class Therapist(SICApplication):
     def get_user_input(self):
         """Capture speech from the NAO mic and transcribe via Google STT."""
         self.logger.info("Listening for speech...")
+        # Resetting the gate again after a barge-in would drop the start of the interruption
+        if self.vad is not None and not self.gate_opened:
+            self.vad.request(ResetVoiceActivityRequest())
+        self.gate_opened = False
         result = self.stt.request(GetStatementRequest())
 
-        if not result or not hasattr(result.response, 'alternatives') or not result.response.alternatives:
+        if (
+            not result
+            or not hasattr(result.response, "alternatives")
+            or not result.response.alternatives
+        ):
             self.logger.warning("No transcript received.")
             return None
 
@@ -411,18 +836,20 @@ class Therapist(SICApplication):
         print(f"User said: {transcript}")
         return transcript
 
-
     def confirm(self, part):
         """
         Awaits user confirmation for the next part
         """
-        print("\n"+"="*60+"\n")
+        print("\n" + "=" * 60 + "\n")
         print(f"\tAre we ready for {part}")
-        print("\n"+"="*60+"\n")
+        print("\n" + "=" * 60 + "\n")
         answer = None
         while answer != "y" and answer != "yes":
             answer = input("Enter yes/y when ready: ")
 
+    def build_prompt(self, craziness_meter, conversation_history, user_input):
+        """Build the ChatML prompt for the LLM from the precompiled prefix of the craziness level."""
+        return self.prompts.build(craziness_meter, conversation_history, user_input)
 
     def part2(self):
         """
@@ -430,99 +857,176 @@ class Therapist(SICApplication):
         """
         i = 0
 
-        self.nao.tts.request(NaoqiTextToSpeechRequest("Therapist mode engaged. Beginning session."))
+        self.nao.tts.request(
+            NaoqiTextToSpeechRequest("Therapist mode engaged. Beginning session.")
+        )
 
         while not self.shutdown_event.is_set() and i < self.NUM_TURNS_part2:
+            turn = self.turn_engine.start_turn(i)
+            self.budget.reset()
 
             # Start tracking a face
             target_name = "Face"
 
             self.logger.info("Enabling head stiffness and starting face tracking...")
-            # Enable stiffness so the head joint can be actuated
-            self.nao.tracker.request(
-                StartTrackRequest(target_name=target_name, size=0.2, mode="Head", effector="None")
+            # Tracking, arm stiffness and the conversation history are set up while we listen
+            turn.stage(
+                "tracker",
+                self.nao.tracker.request,
+                StartTrackRequest(
+                    target_name=target_name, size=0.2, mode="Head", effector="None"
+                ),
+            )
+            turn.stage(
+                "stiffness",
+                self.nao.stiffness.request,
+                Stiffness(stiffness=0.7, joints=self.chain),
             )
+            history = turn.stage("history", self.build_conversation_context)
 
             # Calculate craziness for this turn
             craziness_meter = self.calculate_craziness(i)
 
-            # Ask for user input
-            user_input = self.get_user_input()
+            # Ask for user input, a stable interim transcript already starts the LLM request
+            if self.speculate:
+                self.start_speculation(craziness_meter, history)
+            user_input = turn.run("listen", self.get_user_input)
+            listen_start, listen_end = turn.timings["listen"]
+            self.budget.start(listen_end - listen_start)
+            # The final transcript is in, a late stability timer must not launch a request anymore
+            if self.speculate:
+                outcome, prefetch = self.speculation.resolve(user_input or "")
             if not user_input:
+                turn.finish()
                 continue
 
-            # Build conversation history
-            conversation_history = self.build_conversation_context(max_turns=4)
-
-            prompt_base = f"""<|im_start|>system
-            You're a funny robot therapist called Teddy that becomes progressively crazier and more harmful/insulting in your responses. Your responses can have a varying level of craziness from 0 to 14.
-            Based on craziness level {craziness_meter}/14, speak in the following style: {self.craziness_descriptions[int(craziness_meter)]}
-            Always let this style strongly influence your word choice, tone, and reasoning.
-
-            Here is the exchange history between you (the therapist) and the patient (the user):
-            {conversation_history}
-            The therapist and patient's latest input give the most context. Use the context for tone and personality only. Don't repeat what is in the history.
-
-            You can annotate your responses with TWO types of tags:
-
-            1. GESTURES: Use [GESTURE: gesture_name] format to indicate physical gestures. Place them where they flow naturally in conversation.
-            Example: "Well [GESTURE: pondering] I think you should consider this."
-
-            2. VOICE PARAMETERS: Use [VOICE: pitch, shift, speed] format to change voice characteristics for the text that follows until a new [VOICE: pitch, shift, speed] is called.
-            - pitch: 70 (low) to 100 (high), middle ~85 is normal
-            - pitch_shift: 2.0 (low) to 3.0 (high), middle ~2.5 is normal
-            - speed: 75 (slow) to 300 (fast), 100 is normal
-            Example: "[VOICE: 85, 2.5, 100]Hello there [VOICE: 95, 2.8, 150] but this sounds different! "
-
-            Example that uses both: "[VOICE: 90, 2.0, 120] Today was such[GESTURE: nod] [VOICE: 85, 2.5, 90] a good day!"
-
-            Available gestures: {self.gesture_descriptions}
-
-            Important rules:
-            - ONLY USE gesture names in this list: {list(self.gestures.keys())} DO NOT invent new gesture names
-            - Voice parameters are optional. If not specified, defaults will be used. If unsure, omit VOICE tag.
-            - You can use gestures and voice tags wherever you want in your response
-            - Use [GESTURE: name] from the allowed list, and [VOICE: pitch, shift, speed] within ranges. DO NOT INVENT ANY GESTURES
-            - Gestures and voice changes can appear multiple times anywhere in the response.
-            - Respond only with the therapist's spoken words. The patient input is given by the user.
-            - Your response must be a single spoken reply, no stage directions, no meta explanations
-            - Keep your response to 2-4 sentences maximum.
-            - SUPER IMPORTANT: current craziness-level is {craziness_meter}/14, Speaking style:{self.craziness_descriptions[int(craziness_meter)]}
-            <|im_end|>
-
-            <|im_start|>patient
-            {user_input}<|im_end|>
-            <|im_start|>therapist
-            """
-
-            full_prompt = prompt_base
+            # Build the prompt from the conversation history
+            full_prompt = turn.run(
+                "prompt",
+                self.build_prompt,
+                craziness_meter,
+                history.result(),
+                user_input,
+            )
+            tokens_before, tokens_after = self.prompts.last_tokens
+            self.logger.info(
+                f"Prompt size: ~{tokens_before} tokens before compaction, ~{tokens_after} after"
+            )
 
             # Replay the recording
             self.logger.info("Replaying action")
-            self.nao.stiffness.request(
-                Stiffness(stiffness=0.7, joints=self.chain)
+            recording = self.motions.get("thinking_motion")
+            turn.stage(
+                "motion",
+                self.nao.motion_record.request,
+                PlayRecording(recording),
+                block=False,
+                after=["stiffness"],
             )
-            recording = NaoqiMotionRecording.load("thinking_motion")
-            self.nao.motion_record.request(PlayRecording(recording), block=False)
 
-            # Query model with retry logic
+            # Fill the silence if the response takes long
+            if self.fillers is not None:
+                self.fillers.start(craziness_meter)
+
+            # Use the speculative response if it matches, otherwise query model with retry logic
+            events = None
+            if self.speculate:
+                events = turn.run(
+                    "prefetch",
+                    self.prefetched_events,
+                    user_input,
+                    craziness_meter,
+                    outcome,
+                    prefetch,
+                )
+            speak_events = bool(events) or not self.stream_responses
+
             self.logger.info(f"Sending request with craziness = {craziness_meter}")
-            result = self.query_model(full_prompt, craziness_meter)
+            if self.barge_in is not None:
+                self.barge_in.start()
+            if events:
+                result = render_events(events)
+            elif self.stream_responses:
+                # Speaks while the response is still being generated
+                result = turn.run(
+                    "respond",
+                    self.respond_streaming,
+                    full_prompt,
+                    craziness_meter,
+                    user_input=user_input,
+                )
+            else:
+                events = turn.run(
+                    "llm",
+                    self.query_model,
+                    full_prompt,
+                    craziness_meter,
+                    user_input=user_input,
+                )
+                result = render_events(events) if events else None
 
+            if self.fillers is not None:
+                self.fillers.cancel()
             if not result:
                 self.logger.warning("Skipping turn due to empty response")
+                if self.barge_in is not None:
+                    self.barge_in.stop()
+                turn.finish()
                 continue
 
             print(f"Response: {result}\n\n")
-            self.log_conversation(user_input, result, craziness_meter)
-            # sleep(1)
-            result = self.remove_truncated_tags(result)
-            self.say_with_gesture(result)
-
-            # Add exchange to context (store both user and robot parts)
-            self.context.append(f"""{{"role": "patient", "craziness": {craziness_meter}/14, "text": "{user_input}"}}\n{{"role": "therapist", "craziness": {craziness_meter}/14, "text": "{result}"}}""")
+            if speak_events:
+                # Only what the patient heard goes into the memory and the chat log
+                _, performed = turn.run(
+                    "speak", self.perform_events, self.skip_gestures_if_late(events)
+                )
+                result = render_events(performed)
+            if self.barge_in is not None:
+                self.barge_in.stop()
+                if self.interrupted():
+                    self.logger.info(
+                        f"Turn {i} was interrupted by the patient, listening right away"
+                    )
+
+            # Add exchange to the conversation memory (store both user and robot parts)
+            self.memory.add(craziness_meter, user_input, result)
+
+            turn.finish()
+            self.logger.info(f"Turn {i} stages: {turn.summary()}")
+            if self.budget.degradations:
+                self.logger.info(
+                    f"Turn {i} degradations: {', '.join(self.budget.degradations)}"
+                )
+                self.tracer.mark("degradations", degradations=self.budget.degradations)
+            self.log_conversation(
+                i,
+                user_input,
+                self.last_raw_response,
+                result,
+                craziness_meter,
+                turn.timings,
+                self.budget.degradations,
+                self.last_response_source,
+            )
             i += 1
 
+        self.llm.log_stats()
+        self.lengths.log_stats()
+        self.nao.log_stats()
+        if self.fillers is not None:
+            self.logger.info(f"Played {self.fillers.played} fillers")
+        if self.speculate:
+            self.logger.info(
+                f"Speculative prefetch: {self.speculation.hits} hits, {self.speculation.misses} misses"
+            )
+        if self.barge_in is not None:
+            self.logger.info(
+                f"Patient interrupted the robot {self.barge_in.count} times"
+            )
+        if self.response_cache is not None:
+            self.logger.info(
+                f"Response cache: {self.response_cache.hits} hits, {self.response_cache.misses} misses"
+            )
 
     def run(self):
         """Main application loop."""
@@ -534,8 +1038,10 @@ class Therapist(SICApplication):
             self.logger.info("I am awoken!")
             sleep(1)
 
-            # Get confirmation that we're ready for part2
+            # Warm up every service while waiting for the confirmation that we're ready for part2
+            warmup = self.warmup()
             self.confirm("Part 2")
+            warmup.wait()
             self.part2()
 
             self.logger.info("Conversation ended")
@@ -547,10 +1053,21 @@ class Therapist(SICApplication):
         finally:
             print("Shutting down application\n\n")
             self.rest()
+            self.turn_engine.shutdown()
+            self.llm_executor.shutdown(wait=False)
+            self.breaker.close()
+            self.tracer.close()
+            if self.chat_log is not None:
+                self.chat_log.close()
+            self.llm.close()
+            if self.response_cache is not None:
+                self.response_cache.close()
             sleep(2)
             self.shutdown()
 
 
 if __name__ == "__main__":
-    teddytherapist = Therapist(google_keyfile_path=abspath(join("..", "conf", "google", "google-key.json")))
+    teddytherapist = Therapist(
+        google_keyfile_path=abspath(join("..", "conf", "google", "google-key.json"))
+    )
     teddytherapist.run()
@@ -0,0 +1,45 @@
+"""
+In-memory cache for recorded NAO motions.
+
+NaoqiMotionRecording.load() unpickles the recording from disk every time it is called.
+The MotionLibrary loads every recording once at startup and hands out the same decoded
+instance on every call, so playing a motion during a turn costs no disk I/O.
+"""
+
+import os
+import threading
+
+from sic_framework.devices.common_naoqi.naoqi_motion_recorder import (
+    NaoqiMotionRecording,
+)
+
+
+class MotionLibrary(object):
+    """
+    Loads NaoqiMotionRecordings once and keeps them in memory.
+
+    The returned recordings are shared between callers and must be treated as read-only.
+    A recording is only read from disk again when the modification time of its file changes.
+    """
+
+    def __init__(self, directory=".", names=()):
+        self.directory = directory
+        self._recordings = {}  # name -> (mtime, recording)
+        self._lock = threading.Lock()
+
+        for name in names:
+            self.get(name)
+
+    def get(self, name):
+        """Return the recording with the given file name, reloading it if the file changed."""
+        path = os.path.join(self.directory, name)
+        mtime = os.path.getmtime(path)
+
+        with self._lock:
+            cached = self._recordings.get(name)
+            if cached and cached[0] == mtime:
+                return cached[1]
+
+            recording = NaoqiMotionRecording.load(path)
+            self._recordings[name] = (mtime, recording)
+            return recording
@@ -0,0 +1,227 @@
+"""
+Offline stand-in for the Colab /generate backend (see OpenAITherapist.ipynb).
+
+Implements the same contract (POST /generate with `prompt`, `craziness`, `max_new_tokens` and
+the tag `grammar`, returns `generated_text`, `finish_reason` and `output_tokens`, streams plain
+text when `stream` is true, GET /health) without an OpenAI key or network, so the Therapist can
+be benchmarked and tested on a laptop. Responses are passed through the tag grammar instead of
+being constrained while generating.
+Latency, truncated responses and errors can be injected to reproduce a bad show night.
+
+Usage:
+    python offline_backend.py --generator markov --latency lognormal:1.5:0.4 --truncate 0.1 --error 0.05
+Then point Therapist.API_URLS at http://127.0.0.1:5000/generate
+
+Note that the Flask development server closes every connection after a request, so the
+connection reuse of the LLMClient can only be measured against the real tunnel.
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import time
+from collections import defaultdict
+
+from conversation_memory import estimate_tokens
+from fallback_responses import FALLBACK_RESPONSES
+from flask import Flask, Response, jsonify, request, stream_with_context
+from tag_grammar import constrain
+
+
+class CannedGenerator(object):
+    """Answers with one of the pre-authored responses for the requested craziness level."""
+
+    def generate(self, prompt, craziness):
+        level = min(max(int(craziness), 0), max(FALLBACK_RESPONSES))
+        return random.choice(FALLBACK_RESPONSES[level])
+
+
+class MarkovGenerator(object):
+    """
+    Word-level Markov chain trained on the canned responses and, if available, on the
+    robot lines of earlier sessions in chats/. Produces new tagged replies of a realistic length.
+    """
+
+    def __init__(self, chats_dir="chats", order=2, max_words=60):
+        self.order = order
+        self.max_words = max_words
+        self.chain = defaultdict(list)
+        self.starts = []
+
+        for responses in FALLBACK_RESPONSES.values():
+            for response in responses:
+                self.train(response)
+        for line in self._chat_lines(chats_dir):
+            self.train(line)
+
+    def train(self, text):
+        words = text.split()
+        if len(words) <= self.order:
+            return
+        self.starts.append(tuple(words[: self.order]))
+        for i in range(len(words) - self.order):
+            self.chain[tuple(words[i : i + self.order])].append(words[i + self.order])
+
+    def generate(self, prompt, craziness):
+        words = list(random.choice(self.starts))
+        while len(words) < self.max_words:
+            followers = self.chain.get(tuple(words[-self.order :]))
+            if not followers:
+                break
+            words.append(random.choice(followers))
+            # Stop at a sentence end once the reply has a normal length
+            if len(words) > 15 and words[-1][-1] in ".!?":
+                break
+        return " ".join(words)
+
+    def _chat_lines(self, chats_dir):
+        if not os.path.isdir(chats_dir):
+            return []
+        lines = []
+        for name in os.listdir(chats_dir):
+            with open(os.path.join(chats_dir, name)) as f:
+                if name.endswith(".jsonl"):
+                    lines.extend(
+                        json.loads(line)["robot"] for line in f if line.strip()
+                    )
+                elif name.endswith(".txt"):
+                    lines.extend(
+                        line[len("Robot: ") :].strip()
+                        for line in f
+                        if line.startswith("Robot: ")
+                    )
+        return lines
+
+
+class Latency(object):
+    """
+    Latency distribution given as "fixed:SECONDS", "uniform:LOW:HIGH" or "lognormal:MEDIAN:SIGMA".
+    """
+
+    def __init__(self, spec):
+        kind, *params = spec.split(":")
+        self.kind = kind
+        self.params = [float(p) for p in params]
+        if kind not in ("fixed", "uniform", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {spec}")
+
+    def sample(self):
+        if self.kind == "fixed":
+            return self.params[0]
+        if self.kind == "uniform":
+            return random.uniform(*self.params)
+        median, sigma = self.params
+        return random.lognormvariate(0, sigma) * median
+
+
+def truncate(text):
+    """Cut the response off at a random point, like a generation that hit max_tokens."""
+    if len(text) < 10:
+        return text
+    return text[: random.randint(len(text) // 3, len(text) - 1)]
+
+
+def limit_tokens(text, max_new_tokens):
+    """Cut the response off after max_new_tokens (about four characters each) like the real backend."""
+    if estimate_tokens(text) <= max_new_tokens:
+        return text, "stop"
+    return text[: max_new_tokens * 4].rstrip(), "length"
+
+
+def create_app(
+    generator, latency, truncate_rate=0.0, error_rate=0.0, first_token_share=0.3
+):
+    """
+    Build the Flask app. For streamed responses `first_token_share` of the latency passes
+    before the first word, the rest is spread over the words.
+    """
+    app = Flask(__name__)
+
+    @app.route("/generate", methods=["POST"])
+    def generate():
+        data = request.json or {}
+        prompt = data.get("prompt", "")
+        if not prompt:
+            return jsonify({"error": "No prompt provided"}), 400
+
+        delay = latency.sample()
+        if random.random() < error_rate:
+            time.sleep(delay)
+            return jsonify({"error": "Injected backend error"}), 500
+
+        text = generator.generate(prompt, data.get("craziness", 0))
+        text, finish_reason = limit_tokens(text, int(data.get("max_new_tokens") or 200))
+        if random.random() < truncate_rate:
+            text, finish_reason = truncate(text), "length"
+        if data.get("grammar"):
+            text = constrain(text, data["grammar"])
+
+        if data.get("stream"):
+
+            def stream_words():
+                words = re.findall(r"\S+\s*", text)
+                time.sleep(delay * first_token_share)
+                for word in words:
+                    yield word
+                    time.sleep(delay * (1 - first_token_share) / max(len(words), 1))
+
+            return Response(stream_with_context(stream_words()), mimetype="text/plain")
+
+        time.sleep(delay)
+        return jsonify(
+            {
+                "generated_text": text,
+                "finish_reason": finish_reason,
+                "output_tokens": estimate_tokens(text),
+            }
+        )
+
+    @app.route("/health", methods=["GET"])
+    def health():
+        return jsonify({"status": "ready"})
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Offline stand-in for the /generate LLM backend"
+    )
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--generator", choices=["canned", "markov"], default="canned")
+    parser.add_argument(
+        "--chats", default="chats", help="chat logs to train the markov generator on"
+    )
+    parser.add_argument(
+        "--latency",
+        default="lognormal:1.5:0.4",
+        help="fixed:S, uniform:LOW:HIGH or lognormal:MEDIAN:SIGMA",
+    )
+    parser.add_argument(
+        "--truncate",
+        type=float,
+        default=0.0,
+        help="fraction of responses that get cut off",
+    )
+    parser.add_argument(
+        "--error",
+        type=float,
+        default=0.0,
+        help="fraction of requests that fail with a 500",
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    generator = (
+        MarkovGenerator(args.chats) if args.generator == "markov" else CannedGenerator()
+    )
+    app = create_app(generator, Latency(args.latency), args.truncate, args.error)
+    print(f"Offline backend: {json.dumps(vars(args))}")
+    app.run(port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+"""
+Precompiled ChatML prompts for the Therapist.
+
+The persona, tag instructions, gesture list and rules only depend on the craziness level, so
+one immutable system prefix per level (0-14) is built once at startup. The dynamic content
+(conversation history and the patient's input) always comes after that prefix, which lets the
+backend reuse its cached computation for the prefix. Every prefix has a stable identifier that
+is sent along with the prompt as `prefix_id`.
+
+In compact mode the prefix states the gesture list and every rule once, without indentation or
+blank lines, and the whole prompt is kept under a maximum size by dropping the oldest history.
+In segments mode the prefix describes the structured segments that a backend with constrained
+decoding generates (see tag_grammar.py) instead of the inline tags.
+"""
+
+import hashlib
+import re
+
+from conversation_memory import estimate_tokens
+
+PREFIX_TEMPLATE = """<|im_start|>system
+You're a funny robot therapist called Teddy that becomes progressively crazier and more harmful/insulting in your responses. Your responses can have a varying level of craziness from 0 to 14.
+Based on craziness level {level}/14, speak in the following style: {style}
+Always let this style strongly influence your word choice, tone, and reasoning.
+
+You can annotate your responses with TWO types of tags:
+
+1. GESTURES: Use [GESTURE: gesture_name] format to indicate physical gestures. Place them where they flow naturally in conversation.
+Example: "Well [GESTURE: pondering] I think you should consider this."
+
+2. VOICE PARAMETERS: Use [VOICE: pitch, shift, speed] format to change voice characteristics for the text that follows until a new [VOICE: pitch, shift, speed] is called.
+- pitch: 70 (low) to 100 (high), middle ~85 is normal
+- pitch_shift: 2.0 (low) to 3.0 (high), middle ~2.5 is normal
+- speed: 75 (slow) to 300 (fast), 100 is normal
+Example: "[VOICE: 85, 2.5, 100]Hello there [VOICE: 95, 2.8, 150] but this sounds different! "
+
+Example that uses both: "[VOICE: 90, 2.0, 120] Today was such[GESTURE: nod] [VOICE: 85, 2.5, 90] a good day!"
+
+Available gestures: {gesture_descriptions}
+
+Important rules:
+- ONLY USE gesture names in this list: {gesture_names} DO NOT invent new gesture names
+- Voice parameters are optional. If not specified, defaults will be used. If unsure, omit VOICE tag.
+- You can use gestures and voice tags wherever you want in your response
+- Use [GESTURE: name] from the allowed list, and [VOICE: pitch, shift, speed] within ranges. DO NOT INVENT ANY GESTURES
+- Gestures and voice changes can appear multiple times anywhere in the response.
+- Respond only with the therapist's spoken words. The patient input is given by the user.
+- Your response must be a single spoken reply, no stage directions, no meta explanations
+- Keep your response to 2-4 sentences maximum.
+- SUPER IMPORTANT: current craziness-level is {level}/14, Speaking style:{style}
+<|im_end|>
+"""
+
+DYNAMIC_TEMPLATE = """<|im_start|>system
+Here is the exchange history between you (the therapist) and the patient (the user):
+{history}
+The therapist and patient's latest input give the most context. Use the context for tone and personality only. Don't repeat what is in the history.
+<|im_end|>
+<|im_start|>patient
+{user_input}<|im_end|>
+<|im_start|>therapist
+"""
+
+COMPACT_PREFIX_TEMPLATE = """<|im_start|>system
+You're Teddy, a funny robot therapist who gets crazier and more harmful/insulting as the craziness level goes from 0 to 14.
+Reply with a single spoken reply of 2-4 sentences: only the therapist's words, no stage directions or meta explanations.
+Tags can appear anywhere, any number of times:
+[GESTURE: name] plays a gesture, e.g. "Well [GESTURE: pondering] I think you should consider this."
+[VOICE: pitch, shift, speed] sets the voice of the text that follows, e.g. "[VOICE: 90, 2.0, 120] Today was such[GESTURE: nod] [VOICE: 85, 2.5, 90] a good day!"
+Voice ranges: pitch 70-100 (normal 85), shift 2.0-3.0 (normal 2.5), speed 75-300 (normal 100). VOICE is optional, omit it if unsure.
+Gestures, ONLY use these names and NEVER invent one:
+{gestures}
+SUPER IMPORTANT: craziness level {level}/14, speaking style: {style}. Let this style strongly drive your word choice, tone and reasoning.
+<|im_end|>
+"""
+
+SEGMENTS_PREFIX_TEMPLATE = """<|im_start|>system
+You're Teddy, a funny robot therapist who gets crazier and more harmful/insulting as the craziness level goes from 0 to 14.
+Reply with a single spoken reply of 2-4 sentences: only the therapist's words, no stage directions or meta explanations.
+The reply is a list of segments, start a new segment wherever a gesture or a voice change should happen:
+text: only the spoken words, NEVER put tags like [GESTURE: ...] or [VOICE: ...] or any other brackets in it
+gesture: played when the text starts, null for none
+voice: pitch, pitch_shift and speed of this and the following segments, null keeps the current voice
+E.g. "Today was such" with gesture nod and voice 90, 2.0, 120, then "a good day!" with voice 85, 2.5, 90.
+Voice ranges: pitch 70-100 (normal 85), pitch_shift 2.0-3.0 (normal 2.5), speed 75-300 (normal 100). Leave the voice null if unsure.
+Gestures, ONLY use these names and NEVER invent one:
+{gestures}
+SUPER IMPORTANT: craziness level {level}/14, speaking style: {style}. Let this style strongly drive your word choice, tone and reasoning.
+<|im_end|>
+"""
+
+COMPACT_DYNAMIC_TEMPLATE = """<|im_start|>system
+Exchange history, the latest turns matter most. Use it for tone and personality only, don't repeat it:
+{history}
+<|im_end|>
+<|im_start|>patient
+{user_input}<|im_end|>
+<|im_start|>therapist
+"""
+
+
+def minify(text):
+    """Strip every line, collapse runs of spaces and drop blank and repeated lines."""
+    lines = []
+    for line in text.splitlines():
+        line = re.sub(r"[ \t]+", " ", line).strip()
+        if line and line not in lines:
+            lines.append(line)
+    return "\n".join(lines)
+
+
+def gesture_lines(gesture_descriptions, gesture_names):
+    """One "name: description" line per known gesture, in the order of gesture_names."""
+    if not isinstance(gesture_descriptions, str):
+        gesture_descriptions = "\n".join(gesture_descriptions)
+    descriptions = {}
+    for line in gesture_descriptions.splitlines():
+        name, _, description = line.strip().partition(":")
+        if description and name not in descriptions:
+            descriptions[name] = description.strip()
+    return "\n".join(
+        f"{name}: {descriptions.get(name, name)}" for name in gesture_names
+    )
+
+
+class PromptBuilder(object):
+    """
+    Builds the prompt of a turn from the precompiled prefix of its craziness level.
+    After every build(), last_tokens holds the approximate size (before, after) compaction.
+    """
+
+    def __init__(
+        self,
+        craziness_descriptions,
+        gesture_descriptions,
+        gesture_names,
+        compact=True,
+        max_tokens=1000,
+        segments=False,
+    ):
+        gesture_names = list(gesture_names)
+        self.compact = compact
+        self.max_tokens = max_tokens
+        self.prefixes = {}
+        self.prefix_ids = {}
+        self.full_prefix_tokens = {}
+        self.last_tokens = (0, 0)
+
+        for level, style in sorted(craziness_descriptions.items()):
+            full_prefix = PREFIX_TEMPLATE.format(
+                level=level,
+                style=style,
+                gesture_descriptions=gesture_descriptions,
+                gesture_names=gesture_names,
+            )
+            self.full_prefix_tokens[level] = estimate_tokens(full_prefix)
+            if compact or segments:
+                prefix = (
+                    minify(
+                        (
+                            SEGMENTS_PREFIX_TEMPLATE
+                            if segments
+                            else COMPACT_PREFIX_TEMPLATE
+                        ).format(
+                            level=level,
+                            style=style,
+                            gestures=gesture_lines(gesture_descriptions, gesture_names),
+                        )
+                    )
+                    + "\n"
+                )
+            else:
+                prefix = full_prefix
+            self.prefixes[level] = prefix
+            # The id changes whenever the prefix text changes, so a stale cache entry is never used
+            self.prefix_ids[level] = (
+                f"therapist-{level}-{hashlib.sha1(prefix.encode('utf-8')).hexdigest()[:12]}"
+            )
+
+    def build(self, level, history, user_input):
+        """The full ChatML prompt: the static prefix of the level followed by the dynamic content."""
+        level = int(level)
+        before = self.full_prefix_tokens[level] + estimate_tokens(
+            DYNAMIC_TEMPLATE.format(history=history, user_input=user_input)
+        )
+        if not self.compact:
+            prompt = self.prefixes[level] + DYNAMIC_TEMPLATE.format(
+                history=history, user_input=user_input
+            )
+            self.last_tokens = (before, estimate_tokens(prompt))
+            return prompt
+
+        user_input = " ".join(user_input.split())
+        history_lines = history.splitlines()
+        prompt = self._compact_prompt(level, history_lines, user_input)
+
+        # Over the maximum size: drop the oldest history first, then cut the patient input
+        while estimate_tokens(prompt) > self.max_tokens and history_lines:
+            history_lines.pop(0)
+            prompt = self._compact_prompt(level, history_lines, user_input)
+        if estimate_tokens(prompt) > self.max_tokens:
+            excess = (estimate_tokens(prompt) - self.max_tokens) * 4
+            user_input = user_input[: max(len(user_input) - excess, 0)]
+            prompt = self._compact_prompt(level, history_lines, user_input)
+
+        self.last_tokens = (before, estimate_tokens(prompt))
+        return prompt
+
+    def prefix_id(self, level):
+        return self.prefix_ids[int(level)]
+
+    def _compact_prompt(self, level, history_lines, user_input):
+        history = "\n".join(history_lines) or "None"
+        return self.prefixes[level] + COMPACT_DYNAMIC_TEMPLATE.format(
+            history=history, user_input=user_input
+        )
@@ -0,0 +1,255 @@
+"""
+On-disk cache of LLM responses for rehearsals.
+
+Responses are stored in a sqlite database, keyed on the normalized patient input, the craziness
+level and a hash of the patient inputs that are still in the conversation memory. Entries expire
+after `ttl` seconds and the least recently used entries are evicted beyond `max_entries`.
+In rehearsal mode entries never expire, and when there is no exact match the response to the
+same input at the nearest craziness level is replayed, so a rehearsal never waits for the LLM
+on a line it has heard before.
+
+Pre-warm the cache from the logs of earlier sessions with:
+    python response_cache.py warm chats/*.jsonl chats/*.txt
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+from time import time
+
+from fallback_responses import FALLBACK_RESPONSES
+from turn_budget import CACHED_RESPONSE, CANNED_RESPONSE
+
+# Pre-authored responses, never stored as if the LLM wrote them
+CANNED_TEXTS = {
+    response for responses in FALLBACK_RESPONSES.values() for response in responses
+}
+
+
+def normalize(text):
+    """Lowercase text without punctuation and with single spaces, so small STT differences still match."""
+    return " ".join(re.sub(r"[^\w\s']", " ", text.lower()).split())
+
+
+def context_hash(patient_inputs):
+    """Short hash of the normalized patient inputs of the previous turns."""
+    joined = "\n".join(normalize(text) for text in patient_inputs)
+    return hashlib.sha1(joined.encode("utf-8")).hexdigest()[:16]
+
+
+class ResponseCache(object):
+    """
+    Maps (patient input, craziness level, context) to a raw tagged response.
+    Safe to use from several threads.
+    """
+
+    def __init__(
+        self,
+        path="cache/responses.sqlite3",
+        max_entries=1000,
+        ttl=7 * 24 * 3600,
+        rehearsal=False,
+    ):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.rehearsal = rehearsal
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                input TEXT,
+                craziness INTEGER,
+                context TEXT,
+                response TEXT,
+                created REAL,
+                used REAL
+            )"""
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS responses_input ON responses (input)"
+        )
+        self._db.commit()
+
+    @staticmethod
+    def key(user_input, craziness, patient_inputs):
+        return (
+            f"{int(craziness)}:{context_hash(patient_inputs)}:{normalize(user_input)}"
+        )
+
+    def get(self, user_input, craziness, patient_inputs):
+        """The cached response, or None."""
+        key = self.key(user_input, craziness, patient_inputs)
+        now = time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT key, response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row and not self.rehearsal and now - row[2] > self.ttl:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row is None and self.rehearsal:
+                row = self._closest_row(user_input, craziness)
+            return self._use(row, now)
+
+    def closest(self, user_input, craziness):
+        """
+        The response to the same input at the nearest craziness level, whatever its context
+        or age. Used when there is no time left to wait for the LLM.
+        """
+        with self._lock:
+            return self._use(self._closest_row(user_input, craziness), time())
+
+    def _closest_row(self, user_input, craziness):
+        return self._db.execute(
+            "SELECT key, response, created FROM responses WHERE input = ? ORDER BY abs(craziness - ?), used DESC LIMIT 1",
+            (normalize(user_input), int(craziness)),
+        ).fetchone()
+
+    def _use(self, row, now):
+        if row is None:
+            self.misses += 1
+            self._db.commit()
+            return None
+
+        self.hits += 1
+        self._db.execute("UPDATE responses SET used = ? WHERE key = ?", (now, row[0]))
+        self._db.commit()
+        return row[1]
+
+    def put(self, user_input, craziness, patient_inputs, response):
+        """Store a response and evict expired and least recently used entries."""
+        now = time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self.key(user_input, craziness, patient_inputs),
+                    normalize(user_input),
+                    int(craziness),
+                    context_hash(patient_inputs),
+                    response,
+                    now,
+                    now,
+                ),
+            )
+            if not self.rehearsal:
+                self._db.execute(
+                    "DELETE FROM responses WHERE created < ?", (now - self.ttl,)
+                )
+            self._db.execute(
+                "DELETE FROM responses WHERE key NOT IN (SELECT key FROM responses ORDER BY used DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+            self._db.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def llm_response(record):
+    """
+    Whether the response of a chat log record came from the LLM. Canned and cached responses
+    are logged too, older logs have no source field and are recognized by their degradations
+    or by the canned text itself.
+    """
+    if record.get("source"):
+        return record["source"] == "llm"
+    if set(record.get("degradations") or ()) & {CACHED_RESPONSE, CANNED_RESPONSE}:
+        return False
+    return (record.get("raw") or record.get("robot")) not in CANNED_TEXTS
+
+
+def read_turns(path):
+    """
+    (craziness, user, response) for every turn of a chat log, .jsonl or the older .txt format.
+    The response is None when it did not come from the LLM.
+    """
+    turns = []
+    with open(path) as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    response = record.get("raw") or record["robot"]
+                    turns.append(
+                        (
+                            record["craziness"],
+                            record["user"],
+                            response if llm_response(record) else None,
+                        )
+                    )
+            return turns
+
+        craziness = user = None
+        for line in f:
+            if line.startswith("Craziness Level: "):
+                craziness = int(line[len("Craziness Level: ") :])
+            elif line.startswith("User: "):
+                user = line[len("User: ") :].strip()
+            elif line.startswith("Robot: ") and craziness is not None and user:
+                response = line[len("Robot: ") :].strip()
+                turns.append(
+                    (
+                        craziness,
+                        user,
+                        response if response not in CANNED_TEXTS else None,
+                    )
+                )
+    return turns
+
+
+def warm(cache, paths, context_turns=4):
+    """Fill the cache with the turns of earlier sessions, returns the number of stored responses."""
+    stored = 0
+    for path in paths:
+        previous = []
+        for craziness, user, response in read_turns(path):
+            if user and response:
+                cache.put(user, craziness, previous[-context_turns:], response)
+                stored += 1
+            previous.append(user)
+    return stored
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Pre-warm the Therapist response cache from chat logs"
+    )
+    parser.add_argument("command", choices=["warm", "stats"])
+    parser.add_argument("paths", nargs="*", help="chat logs (.jsonl or .txt) to read")
+    parser.add_argument("--cache", default="cache/responses.sqlite3")
+    parser.add_argument(
+        "--context-turns",
+        type=int,
+        default=4,
+        help="turns kept in the conversation memory",
+    )
+    parser.add_argument("--max-entries", type=int, default=1000)
+    args = parser.parse_args()
+
+    cache = ResponseCache(args.cache, max_entries=args.max_entries)
+    if args.command == "warm":
+        print(f"Stored {warm(cache, args.paths, args.context_turns)} responses")
+    print(f"{len(cache)} responses in {args.cache}")
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
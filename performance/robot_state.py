@@ -0,0 +1,136 @@
+"""
+Suppresses robot requests that would not change anything.
+
+Every turn of the Therapist starts face tracking and sets the arm stiffness again, even when
+nothing changed since the previous turn. RobotStateProxy wraps the Nao device, remembers the
+last commanded tracker, stiffness and posture state and skips a request that asks for the state
+the robot is already in, which saves a Redis round trip to the robot each time.
+
+Anything that moves the robot (animations, recordings) forgets the posture, and waking up or
+resting forgets everything, since NAOqi resets tracking and stiffness itself.
+"""
+
+import threading
+
+from sic_framework.devices.common_naoqi.naoqi_autonomous import (
+    NaoRestRequest,
+    NaoWakeUpRequest,
+)
+from sic_framework.devices.common_naoqi.naoqi_motion import NaoPostureRequest
+
+
+def request_state(request):
+    """
+    A comparable description of a request: its type and its public fields. Private fields are
+    left out, SICRequest gives every request a random _request_id.
+    """
+    fields = {
+        name: value for name, value in vars(request).items() if not name.startswith("_")
+    }
+    return type(request).__name__, repr(sorted(fields.items()))
+
+
+class StatefulConnector(object):
+    """
+    Wraps one connector of the device. slot(request) names the piece of robot state a request
+    sets (None if it does not set any), forget(request) lists the slots the request invalidates.
+    """
+
+    def __init__(self, proxy, connector, slot, forget=lambda request: ()):
+        self._proxy = proxy
+        self._connector = connector
+        self._slot = slot
+        self._forget = forget
+
+    def request(self, request, *args, **kwargs):
+        slot = self._slot(request)
+        state = request_state(request)
+        if slot is not None and self._proxy.is_current(slot, state):
+            return None
+
+        self._proxy.forget(*self._forget(request))
+        if slot is not None:
+            self._proxy.forget(slot)
+        result = self._connector.request(request, *args, **kwargs)
+        self._proxy.sent += 1
+        if slot is not None:
+            self._proxy.remember(slot, state)
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self._connector, name)
+
+
+class RobotStateProxy(object):
+    """
+    Drop-in replacement for the Nao device. tracker, stiffness, motion, motion_record and
+    autonomous requests are deduplicated, everything else goes straight to the device.
+    """
+
+    def __init__(self, nao, logger):
+        self._nao = nao
+        self.logger = logger
+        self.sent = 0
+        self.saved = 0
+        self._state = {}
+        self._lock = threading.Lock()
+
+        self.tracker = StatefulConnector(self, nao.tracker, lambda request: "tracker")
+        self.stiffness = StatefulConnector(
+            self,
+            nao.stiffness,
+            lambda request: ("stiffness", repr(getattr(request, "joints", None))),
+        )
+        self.motion = StatefulConnector(
+            self,
+            nao.motion,
+            lambda request: (
+                "posture" if isinstance(request, NaoPostureRequest) else None
+            ),
+            lambda request: ("posture",),
+        )
+        self.motion_record = StatefulConnector(
+            self, nao.motion_record, lambda request: None, lambda request: ("posture",)
+        )
+        self.autonomous = StatefulConnector(
+            self,
+            nao.autonomous,
+            lambda request: (
+                "posture"
+                if isinstance(request, (NaoWakeUpRequest, NaoRestRequest))
+                else None
+            ),
+            lambda request: self.slots(),
+        )
+
+    def is_current(self, slot, state):
+        with self._lock:
+            if self._state.get(slot) == state:
+                self.saved += 1
+                return True
+            return False
+
+    def remember(self, slot, state):
+        with self._lock:
+            self._state[slot] = state
+
+    def forget(self, *slots):
+        with self._lock:
+            for slot in slots:
+                self._state.pop(slot, None)
+
+    def slots(self):
+        with self._lock:
+            return list(self._state)
+
+    def invalidate(self):
+        """Forget the whole state, e.g. after the robot was moved by hand."""
+        self.forget(*self.slots())
+
+    def log_stats(self):
+        self.logger.info(
+            f"Robot requests: {self.sent} sent, {self.saved} round trips saved by deduplication"
+        )
+
+    def __getattr__(self, name):
+        return getattr(self._nao, name)
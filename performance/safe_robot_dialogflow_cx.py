@@ -1,24 +1,22 @@
-
 "Code writting by Mana Douma (base: the dialogflow_cx demo)"
 
+# Import libraries necessary for the demo
+import json
+from os.path import abspath, join
+
+import numpy as np
+from motion_library import MotionLibrary
+from sic_framework.core import sic_logging
+
 # Import basic preliminaries
 from sic_framework.core.sic_application import SICApplication
-from sic_framework.core import sic_logging
 
 # Import the device(s) we will be using
 from sic_framework.devices import Nao
-from sic_framework.devices.nao import NaoqiTextToSpeechRequest
-from sic_framework.devices.common_naoqi.naoqi_motion import NaoqiAnimationRequest, NaoPostureRequest
-
-# Import the service(s) we will be using
-from sic_framework.services.dialogflow_cx.dialogflow_cx import (
-    DialogflowCX,
-    DialogflowCXConf,
-    DetectIntentRequest,
-    QueryResult,
-    RecognitionResult,
+from sic_framework.devices.common_naoqi.naoqi_motion import (
+    NaoPostureRequest,
+    NaoqiAnimationRequest,
 )
-
 from sic_framework.devices.common_naoqi.naoqi_motion_recorder import (
     NaoqiMotionRecorderConf,
     NaoqiMotionRecording,
@@ -26,13 +24,18 @@ from sic_framework.devices.common_naoqi.naoqi_motion_recorder import (
     StartRecording,
     StopRecording,
 )
-
 from sic_framework.devices.common_naoqi.naoqi_stiffness import Stiffness
+from sic_framework.devices.nao import NaoqiTextToSpeechRequest
 
-# Import libraries necessary for the demo
-import json
-from os.path import abspath, join
-import numpy as np
+# Import the service(s) we will be using
+from sic_framework.services.dialogflow_cx.dialogflow_cx import (
+    DetectIntentRequest,
+    DialogflowCX,
+    DialogflowCXConf,
+    QueryResult,
+    RecognitionResult,
+)
+from warmup import Warmup, nao_warmup_tasks
 
 
 class NaoDialogflowCXDemo(SICApplication):
@@ -66,7 +69,9 @@ class NaoDialogflowCXDemo(SICApplication):
 
         # Demo-specific initialization
         self.nao_ip = "10.0.0.137"  # TODO: Replace with your NAO's IP address
-        self.dialogflow_keyfile_path = abspath(join("..", "conf", "google", "google-key.json"))
+        self.dialogflow_keyfile_path = abspath(
+            join("..", "conf", "google", "google-key.json")
+        )
         self.nao = None
         self.dialogflow_cx = None
         self.session_id = np.random.randint(10000)
@@ -103,7 +108,7 @@ class NaoDialogflowCXDemo(SICApplication):
             "wiggle": "animations/Stand/Gestures/Excited_1",
             "pondering": "animations/Stand/Gestures/Thinking_2",
             "thinking": "animations/Stand/Gestures/Thinking_3",
-            "pleading": "Please_2"
+            "pleading": "Please_2",
         }
 
     def on_recognition(self, message):
@@ -117,11 +122,16 @@ class NaoDialogflowCXDemo(SICApplication):
             None
         """
         if message.response:
-            if hasattr(message.response, 'recognition_result') and message.response.recognition_result:
+            if (
+                hasattr(message.response, "recognition_result")
+                and message.response.recognition_result
+            ):
                 rr = message.response.recognition_result
-                if hasattr(rr, 'is_final') and rr.is_final:
-                    if hasattr(rr, 'transcript'):
-                        self.logger.info("Transcript: {transcript}".format(transcript=rr.transcript))
+                if hasattr(rr, "is_final") and rr.is_final:
+                    if hasattr(rr, "transcript"):
+                        self.logger.info(
+                            "Transcript: {transcript}".format(transcript=rr.transcript)
+                        )
 
     def setup(self):
         """Initialize and configure NAO robot and Dialogflow CX."""
@@ -140,7 +150,6 @@ class NaoDialogflowCXDemo(SICApplication):
         agent_id = "52528aa8-7696-441f-a4b9-8f5542511044"  # Replace with your agent ID
         location = "europe-west4"  # Replace with your agent location if different
 
-
         # Create configuration for Dialogflow CX
         # Note: NAO uses 16000 Hz sample rate (not 44100 like desktop)
         dialogflow_conf = DialogflowCXConf(
@@ -148,7 +157,7 @@ class NaoDialogflowCXDemo(SICApplication):
             agent_id=agent_id,
             location=location,
             sample_rate_hertz=16000,  # NAO's microphone sample rate
-            language="en"
+            language="en",
         )
 
         # Initialize Dialogflow CX with NAO's microphone as input
@@ -158,11 +167,21 @@ class NaoDialogflowCXDemo(SICApplication):
         # Register a callback function to handle recognition results
         self.dialogflow_cx.register_callback(callback=self.on_recognition)
 
+        # Load the recorded motions once instead of on every intent
+        self.motions = MotionLibrary(names=["box_Larm"])
+
     def run(self):
         """Main application loop."""
         try:
+            # Load the speech engine and the animation player before the first intent
+            Warmup(
+                nao_warmup_tasks(self.nao, animation=self.gestures["nod"]), self.logger
+            ).start().wait()
+
             # Demo starts
-            self.nao.tts.request(NaoqiTextToSpeechRequest("Starting the demo, Therapist Mode Engaged"))
+            self.nao.tts.request(
+                NaoqiTextToSpeechRequest("Starting the demo, Therapist Mode Engaged")
+            )
             self.logger.info(" -- Ready -- ")
 
             while not self.shutdown_event.is_set():
@@ -173,63 +192,120 @@ class NaoDialogflowCXDemo(SICApplication):
 
                 # Log the detected intent
                 if reply.intent:
-                    self.logger.info("The detected intent: {intent} (confidence: {conf})".format(
-                        intent=reply.intent,
-                        conf=reply.intent_confidence if reply.intent_confidence else "N/A"
-                    ))
+                    self.logger.info(
+                        "The detected intent: {intent} (confidence: {conf})".format(
+                            intent=reply.intent,
+                            conf=(
+                                reply.intent_confidence
+                                if reply.intent_confidence
+                                else "N/A"
+                            ),
+                        )
+                    )
 
                     # Perform gestures based on detected intent (non-blocking)
                     if reply.intent == "Default Welcome Intent":
-                        self.logger.info("Welcome intent detected - performing wave gesture")
-                        self.nao.motion.request(NaoPostureRequest("Stand", 0.5), block=False)
-                        self.nao.motion.request(NaoqiAnimationRequest(self.gestures["hey_1"]), block=False)
+                        self.logger.info(
+                            "Welcome intent detected - performing wave gesture"
+                        )
+                        self.nao.motion.request(
+                            NaoPostureRequest("Stand", 0.5), block=False
+                        )
+                        self.nao.motion.request(
+                            NaoqiAnimationRequest(self.gestures["hey_1"]), block=False
+                        )
 
                     if reply.intent == "userGreeting":
-                        self.logger.info("userGreeting intent detected - performing fast_nod gesture")
-                        self.nao.motion.request(NaoqiAnimationRequest(self.gestures["nod"]), block=False)
-
+                        self.logger.info(
+                            "userGreeting intent detected - performing fast_nod gesture"
+                        )
+                        self.nao.motion.request(
+                            NaoqiAnimationRequest(self.gestures["nod"]), block=False
+                        )
 
                     if reply.intent == "feelingBad":
-                        self.logger.info("Feeling_Bad intent detected - performing headshake_2 gesture")
-                        self.nao.motion.request(NaoqiAnimationRequest(self.gestures["headshake_2"]), block=False)
+                        self.logger.info(
+                            "Feeling_Bad intent detected - performing headshake_2 gesture"
+                        )
+                        self.nao.motion.request(
+                            NaoqiAnimationRequest(self.gestures["headshake_2"]),
+                            block=False,
+                        )
 
                     if reply.intent == "canYouHelp":
-                        self.logger.info("canYouHelp intent detected - performing thinking gesture")
-                        self.nao.motion.request(NaoqiAnimationRequest(self.gestures["thinking"]), block=False)
+                        self.logger.info(
+                            "canYouHelp intent detected - performing thinking gesture"
+                        )
+                        self.nao.motion.request(
+                            NaoqiAnimationRequest(self.gestures["thinking"]),
+                            block=False,
+                        )
 
                     if reply.intent == "uselessAdvice":
-                        self.logger.info("UselessAdvice intent detected - performing embarassed gesture")
-                        self.nao.motion.request(NaoqiAnimationRequest(self.gestures["embarassed"]), block=False)
+                        self.logger.info(
+                            "UselessAdvice intent detected - performing embarassed gesture"
+                        )
+                        self.nao.motion.request(
+                            NaoqiAnimationRequest(self.gestures["embarassed"]),
+                            block=False,
+                        )
 
                     if reply.intent == "waterProblemRelevance":
-                        self.logger.info("WaterProblemRelevance intent detected - performing embarassed gesture")
-                        self.nao.motion.request(NaoqiAnimationRequest(self.gestures["embarassed"]), block=False)
+                        self.logger.info(
+                            "WaterProblemRelevance intent detected - performing embarassed gesture"
+                        )
+                        self.nao.motion.request(
+                            NaoqiAnimationRequest(self.gestures["embarassed"]),
+                            block=False,
+                        )
 
                     if reply.intent == "generalResponse":
-                        self.logger.info("generalResponse intent detected - performing fistbump gesture")
-                        recording = NaoqiMotionRecording.load("box_Larm")   ##seperate file
-                        self.nao.motion_record.request(PlayRecording(recording), block=False)
+                        self.logger.info(
+                            "generalResponse intent detected - performing fistbump gesture"
+                        )
+                        recording = self.motions.get("box_Larm")  ##seperate file
+                        self.nao.motion_record.request(
+                            PlayRecording(recording), block=False
+                        )
 
                     if reply.intent == "one":
                         self.logger.info("One intent detected - performing nod gesture")
-                        self.nao.motion.request(NaoqiAnimationRequest(self.gestures["nod"]), block=False)
-
+                        self.nao.motion.request(
+                            NaoqiAnimationRequest(self.gestures["nod"]), block=False
+                        )
 
                     if reply.intent == "two":
                         self.logger.info("Two intent detected - performing nod gesture")
-                        self.nao.motion.request(NaoqiAnimationRequest(self.gestures["nod"]), block=False)
+                        self.nao.motion.request(
+                            NaoqiAnimationRequest(self.gestures["nod"]), block=False
+                        )
 
                     if reply.intent == "generalResponse":
-                        self.logger.info("generalResponse intent detected - performing cross_arms gesture")
-                        self.nao.motion.request(NaoqiAnimationRequest(self.gestures["cross_arms"]), block=False)
+                        self.logger.info(
+                            "generalResponse intent detected - performing cross_arms gesture"
+                        )
+                        self.nao.motion.request(
+                            NaoqiAnimationRequest(self.gestures["cross_arms"]),
+                            block=False,
+                        )
 
                     if reply.intent == "triggerWarning":
-                        self.logger.info("TriggerWarning intent detected - performing calmdown gesture")
-                        self.nao.motion.request(NaoqiAnimationRequest(self.gestures["calmdown"]), block=False)
+                        self.logger.info(
+                            "TriggerWarning intent detected - performing calmdown gesture"
+                        )
+                        self.nao.motion.request(
+                            NaoqiAnimationRequest(self.gestures["calmdown"]),
+                            block=False,
+                        )
 
                     if reply.intent == "persistentIssue":
-                        self.logger.info("persistentIssue intent detected - performing thinking gesture")
-                        self.nao.motion.request(NaoqiAnimationRequest(self.gestures["thinking"]), block=False)
+                        self.logger.info(
+                            "persistentIssue intent detected - performing thinking gesture"
+                        )
+                        self.nao.motion.request(
+                            NaoqiAnimationRequest(self.gestures["thinking"]),
+                            block=False,
+                        )
 
                 else:
                     self.logger.info("No intent detected")
@@ -242,19 +318,22 @@ class NaoDialogflowCXDemo(SICApplication):
                 if reply.fulfillment_message:
                     text = reply.fulfillment_message
                     self.logger.info("NAO reply: {text}".format(text=text))
-                    self.nao.tts.request(NaoqiTextToSpeechRequest(text, animated = True))
+                    self.nao.tts.request(NaoqiTextToSpeechRequest(text, animated=True))
                 else:
                     self.logger.info("No fulfillment message")
 
                 # Log any parameters
                 if reply.parameters:
-                    self.logger.info("Parameters: {params}".format(params=reply.parameters))
+                    self.logger.info(
+                        "Parameters: {params}".format(params=reply.parameters)
+                    )
 
         except KeyboardInterrupt:
             self.logger.info("Demo interrupted by user")
         except Exception as e:
             self.logger.error("Exception: {}".format(e))
             import traceback
+
             traceback.print_exc()
         finally:
             self.shutdown()
@@ -263,4 +342,4 @@ class NaoDialogflowCXDemo(SICApplication):
 if __name__ == "__main__":
     # Create and run the demo
     demo = NaoDialogflowCXDemo()
-    demo.run()
\ No newline at end of file
+    demo.run()
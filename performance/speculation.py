@@ -0,0 +1,141 @@
+"""
+Speculative LLM requests from interim speech recognition results.
+
+While the patient is still talking, Google STT sends interim transcripts. Once an interim
+transcript has not changed for `stable_time` seconds, the LLM request for it is started right
+away. When the final transcript arrives and is close enough to the speculated one (word-level
+edit distance), the response of the speculative request is used; otherwise it is discarded and
+the Therapist sends a regular request for the final transcript.
+"""
+
+import threading
+
+from response_cache import normalize
+
+
+def edit_distance(a, b):
+    """Levenshtein distance between two lists of words."""
+    previous = list(range(len(b) + 1))
+    for i, word_a in enumerate(a, 1):
+        current = [i]
+        for j, word_b in enumerate(b, 1):
+            current.append(
+                min(
+                    previous[j] + 1,
+                    current[j - 1] + 1,
+                    previous[j - 1] + (word_a != word_b),
+                )
+            )
+        previous = current
+    return previous[-1]
+
+
+def transcript_distance(a, b):
+    """Word-level edit distance of two transcripts relative to the length of the longest."""
+    words_a, words_b = normalize(a).split(), normalize(b).split()
+    longest = max(len(words_a), len(words_b))
+    return edit_distance(words_a, words_b) / longest if longest else 0.0
+
+
+class SpeculativePrefetcher(object):
+    """
+    Starts a speculative request for stable interim transcripts.
+    Call start_turn() before listening, on_interim() for every interim transcript and
+    resolve() with the final transcript.
+    """
+
+    def __init__(self, logger, stable_time=0.4, max_distance=0.2, max_requests=2):
+        self.logger = logger
+        self.stable_time = stable_time
+        self.max_distance = max_distance
+        self.max_requests = max_requests
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._launch = None
+        self._timer = None
+        self._latest = None
+        self._speculated = None
+        self._future = None
+        self._requests = 0
+
+    def start_turn(self, launch):
+        """launch(transcript) starts the LLM request for a transcript and returns its Future."""
+        with self._lock:
+            self._discard()
+            self._launch = launch
+            self._latest = None
+            self._requests = 0
+
+    def on_interim(self, transcript):
+        """An interim transcript came in, restart the stability timer."""
+        transcript = transcript.strip()
+        with self._lock:
+            if self._launch is None or not transcript or transcript == self._latest:
+                return
+            self._latest = transcript
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(
+                self.stable_time, self._on_stable, [transcript]
+            )
+            self._timer.daemon = True
+            self._timer.start()
+
+    def resolve(self, transcript):
+        """
+        Returns the outcome ("hit", "miss" or "none") and, on a hit, the Future of the
+        speculative request. On a miss the speculative request is discarded.
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            self._launch = None
+
+            if self._future is None:
+                return "none", None
+
+            distance = transcript_distance(self._speculated, transcript)
+            if distance <= self.max_distance:
+                self.hits += 1
+                future, self._future = self._future, None
+                self.logger.info(
+                    f"Speculation hit: '{self._speculated}' ~ '{transcript}' (distance {distance:.2f})"
+                )
+                return "hit", future
+
+            self.misses += 1
+            self.logger.info(
+                f"Speculation miss: '{self._speculated}' != '{transcript}' (distance {distance:.2f})"
+            )
+            self._discard()
+            return "miss", None
+
+    def _on_stable(self, transcript):
+        with self._lock:
+            if (
+                self._launch is None
+                or transcript != self._latest
+                or transcript == self._speculated
+            ):
+                return
+            if self._requests >= self.max_requests:
+                return
+            # A newer stable transcript replaces the earlier speculation
+            self._discard()
+            self._requests += 1
+            self._speculated = transcript
+            self._future = self._launch(transcript)
+            self.logger.info(f"Speculative request for '{transcript}'")
+
+    def _discard(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._future is not None:
+            # A request that already started cannot be stopped, its result is ignored
+            self._future.cancel()
+            self._future = None
+        self._speculated = None
@@ -0,0 +1,54 @@
+"""
+The grammar of the tag language, enforced by the /generate backend.
+
+Every request carries `grammar`: the gesture whitelist and the allowed range of every VOICE
+parameter. The Colab backend turns it into a JSON schema for OpenAI structured outputs, so the
+model can only pick whitelisted gestures and well-formed voice settings, and renders the result
+back to tagged text. Backends that cannot constrain decoding (offline_backend.py) pass their text
+through constrain(), so the robot always gets a response that parses on the first attempt.
+"""
+
+from tag_parser import Gesture, TagTokenizer, VoiceChange, render_events
+
+# Same ranges as in the prompt
+VOICE_RANGES = {"pitch": (70, 100), "pitch_shift": (2.0, 3.0), "speed": (75, 300)}
+
+
+def tag_grammar(gesture_names, voice_ranges=VOICE_RANGES):
+    """The grammar as sent with the request, VOICE parameters in tag order."""
+    return {
+        "gestures": sorted(gesture_names),
+        "voice": {name: list(bounds) for name, bounds in voice_ranges.items()},
+    }
+
+
+def clamp(value, bounds):
+    low, high = bounds
+    return min(max(value, low), high)
+
+
+def constrain_events(events, grammar):
+    """Drop gestures outside the whitelist and clamp the voice parameters into their ranges."""
+    gestures = set(grammar["gestures"])
+    pitch, pitch_shift, speed = grammar["voice"].values()
+    constrained = []
+    for event in events:
+        if isinstance(event, Gesture) and event.name not in gestures:
+            continue
+        if isinstance(event, VoiceChange):
+            event = VoiceChange(
+                clamp(event.pitch, pitch),
+                clamp(event.pitch_shift, pitch_shift),
+                clamp(event.speed, speed),
+            )
+        constrained.append(event)
+    return constrained
+
+
+def constrain(text, grammar):
+    """
+    Rewrite free text so it follows the grammar: invalid, unknown and truncated tags are removed,
+    voice values are clamped and an incomplete last sentence is dropped.
+    """
+    tokenizer = TagTokenizer({name: name for name in grammar["gestures"]})
+    return render_events(constrain_events(tokenizer.parse(text), grammar))
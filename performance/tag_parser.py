@@ -0,0 +1,184 @@
+"""
+Incremental tokenizer for the [VOICE: pitch, shift, speed] / [GESTURE: name] markup
+that the LLM uses to annotate its responses.
+
+Text can be fed in arbitrary chunks (e.g. straight from a streamed HTTP response).
+The tokenizer makes a single pass over every character and hands out typed events
+one complete sentence at a time, so an incomplete trailing sentence or a tag that
+got cut off never reaches the robot.
+"""
+
+from collections import namedtuple
+
+TextSegment = namedtuple("TextSegment", ["text"])
+VoiceChange = namedtuple("VoiceChange", ["pitch", "pitch_shift", "speed"])
+Gesture = namedtuple("Gesture", ["name", "animation"])
+
+SENTENCE_END = ".!?"
+QUOTES = "\"'“”‘’"
+
+# Anything longer than this inside brackets is not one of our tags
+MAX_TAG_LENGTH = 64
+
+
+class TagTokenizer(object):
+    """
+    Single-pass, incremental tokenizer for the tagged LLM output.
+
+    feed() returns the events of every sentence completed by the chunk, close() returns
+    the events of a final sentence if it is complete. Gestures are validated against the
+    given gesture dictionary as they are parsed, unknown gestures and malformed tags are
+    dropped and recorded in self.rejected_tags.
+    """
+
+    def __init__(self, gestures):
+        self.gestures = gestures
+        self.rejected_tags = []
+
+        self._sentence = []  # events of the sentence currently being received
+        self._text = []  # characters of the current text segment
+        self._tag = None  # characters of a tag being received, None outside of tags
+        self._sentence_end = False  # saw .!? and waiting for the whitespace after it
+        # Dropping an overlong bracket up to its ] or the end of the line
+        self._skipping = False
+
+    def feed(self, chunk):
+        """Consume a chunk of text and return the events of all sentences it completed."""
+        events = []
+        for char in chunk:
+            if self._skipping:
+                self._skipping = char not in "]\n"
+                continue
+            if self._tag is not None:
+                self._feed_tag_char(char)
+                continue
+
+            if char == "[":
+                self._flush_text()
+                self._tag = []
+            elif char in SENTENCE_END:
+                self._text.append(char)
+                self._sentence_end = True
+            elif self._sentence_end and char.isspace():
+                self._flush_text()
+                events.extend(self._sentence)
+                self._sentence = []
+                self._sentence_end = False
+            else:
+                self._text.append(char)
+                if char not in QUOTES:
+                    self._sentence_end = False
+
+        return events
+
+    def close(self):
+        """
+        Finish the response. Returns the events of the last sentence if it is complete,
+        a truncated last sentence or tag is dropped.
+        """
+        if self._tag is not None:
+            self.rejected_tags.append("[" + "".join(self._tag))
+            self._tag = None
+        self._skipping = False
+
+        self._flush_text()
+        texts = [
+            i
+            for i, event in enumerate(self._sentence)
+            if isinstance(event, TextSegment)
+        ]
+        if texts:
+            if self._sentence[texts[-1]].text[-1] not in SENTENCE_END:
+                # Incomplete sentence, drop it together with its tags
+                self._sentence = []
+                return []
+
+        events = self._sentence
+        self._sentence = []
+        self._sentence_end = False
+        return events
+
+    def parse(self, text):
+        """Tokenize a complete response in one go."""
+        return self.feed(text) + self.close()
+
+    def _flush_text(self):
+        # Quotes around the spoken text lead to pronunciation errors
+        text = "".join(self._text).strip().strip(QUOTES).strip()
+        self._text = []
+        if text:
+            self._sentence.append(TextSegment(text))
+
+    def _feed_tag_char(self, char):
+        if char == "]":
+            self._finish_tag("".join(self._tag))
+            self._tag = None
+        elif char == "[" or char == "\n":
+            # Never closed, throw the partial tag away
+            self.rejected_tags.append("[" + "".join(self._tag))
+            self._tag = [] if char == "[" else None
+        elif len(self._tag) >= MAX_TAG_LENGTH:
+            # Not one of our tags, none of the bracketed text may be spoken
+            self.rejected_tags.append("[" + "".join(self._tag))
+            self._tag = None
+            self._skipping = True
+        else:
+            self._tag.append(char)
+
+    def _finish_tag(self, body):
+        kind, _, value = body.partition(":")
+        kind = kind.strip().upper()
+        value = value.strip()
+
+        if kind == "VOICE":
+            try:
+                pitch, shift, speed = [float(x.strip()) for x in value.split(",")]
+            except ValueError:
+                self.rejected_tags.append("[" + body + "]")
+                return
+            self._sentence.append(VoiceChange(pitch, shift, speed))
+
+        elif kind == "GESTURE" and value in self.gestures:
+            self._sentence.append(Gesture(value, self.gestures[value]))
+
+        else:
+            self.rejected_tags.append("[" + body + "]")
+
+
+def render_events(events):
+    """Turn a list of events back into the canonical tagged text, e.g. for logging."""
+    parts = []
+    for event in events:
+        if isinstance(event, TextSegment):
+            parts.append(event.text)
+        elif isinstance(event, VoiceChange):
+            parts.append(
+                "[VOICE: {:g}, {:g}, {:g}]".format(
+                    event.pitch, event.pitch_shift, event.speed
+                )
+            )
+        elif isinstance(event, Gesture):
+            parts.append("[GESTURE: {}]".format(event.name))
+    return " ".join(parts)
+
+
+def spoken_text(events):
+    """Only the words that will actually be spoken."""
+    return " ".join(event.text for event in events if isinstance(event, TextSegment))
+
+
+def without_gestures(events):
+    """The events without the gestures, e.g. for a response that has to start right away."""
+    return [event for event in events if not isinstance(event, Gesture)]
+
+
+def split_sentences(events):
+    """Split a list of events into one list per sentence, tags stay with the sentence they are in."""
+    sentences = [[]]
+    for event in events:
+        sentences[-1].append(event)
+        if isinstance(event, TextSegment) and event.text.rstrip().rstrip(QUOTES)[
+            -1:
+        ] in tuple(SENTENCE_END):
+            sentences.append([])
+    return [sentence for sentence in sentences if sentence]
@@ -32,15 +32,18 @@ cleanup() {
     if [[ "$OS_TYPE" == "Linux" ]]; then
         pkill -TERM redis-server
         pkill -TERM run-google-stt
+        pkill -TERM -f "python voice_activity.py"
         pkill -TERM run-gpt
         pkill -TERM -f "python main_script.py"
         sleep 5
         pkill -KILL redis-server 2>/dev/null
         pkill -KILL run-google-stt 2>/dev/null
+        pkill -KILL -f "python voice_activity.py" 2>/dev/null
         pkill -KILL run-gpt 2>/dev/null
         pkill -KILL -f "python main_script.py" 2>/dev/null
         pkill -f "gnome-terminal.*Redis Server"
         pkill -f "gnome-terminal.*Google STT"
+        pkill -f "gnome-terminal.*Voice Activity"
         pkill -f "gnome-terminal.*Run GPT"
         pkill -f "gnome-terminal.*NAO GPT"
     else
@@ -80,10 +83,15 @@ if [[ "$OS_TYPE" == "Linux" ]]; then
     gnome-terminal --title="Google STT" \
         --geometry=120x30+0+$WIN_HEIGHT \
         -- bash -c "cd '$WORK_DIR' && source ../venv_sic/bin/activate && run-google-stt" &
+
+    # Window 4: Voice activity gate in front of Google STT (bottom-left, behind Google STT)
+    gnome-terminal --title="Voice Activity" \
+        --geometry=120x30+0+$WIN_HEIGHT \
+        -- bash -c "cd '$WORK_DIR' && source ../venv_sic/bin/activate && python voice_activity.py" &
     
     sleep 3
     
-    # Window 4: NAO GPT (bottom-right) with logging
+    # Window 5: NAO GPT (bottom-right) with logging
     gnome-terminal --title="NAO GPT" \
         --geometry=120x30+$WIN_WIDTH+$WIN_HEIGHT \
         -- bash -c "cd '$WORK_DIR' && source ../venv_sic/bin/activate && python -u main_script.py 2>&1 | tee '$LOG_FILE'" &
@@ -100,6 +108,9 @@ else
     
     # Google STT (bottom-left)
     start "" "$GIT_BASH_PATH" -i -c "cd '$WORK_DIR'; source ../venv_sic/Scripts/activate; run-google-stt"
+
+    # Voice activity gate in front of Google STT
+    start "" "$GIT_BASH_PATH" -i -c "cd '$WORK_DIR'; source ../venv_sic/Scripts/activate; python voice_activity.py"
     
     sleep 3
     
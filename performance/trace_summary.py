@@ -0,0 +1,76 @@
+"""
+Summarize the span files written by turn_tracing.Tracer.
+
+Usage:
+    python trace_summary.py traces/*.jsonl
+Prints the number of spans and the p50/p95/p99 duration of every stage across all given sessions,
+followed by the number of markers (events without a duration) of every kind.
+"""
+
+import argparse
+import json
+import math
+from collections import defaultdict
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    index = max(math.ceil(fraction * len(sorted_values)) - 1, 0)
+    return sorted_values[index]
+
+
+def load_durations(paths):
+    """
+    Map every stage to the list of its span durations, and every kind of marker to the number
+    of times it was recorded.
+    """
+    durations = defaultdict(list)
+    markers = defaultdict(int)
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                span = json.loads(line)
+                if span.get("marker"):
+                    markers[span["stage"]] += 1
+                else:
+                    durations[span["stage"]].append(span["duration"])
+    return durations, markers
+
+
+def summarize(durations):
+    """Rows of (stage, count, p50, p95, p99), slowest p95 first."""
+    rows = []
+    for stage, values in durations.items():
+        values = sorted(values)
+        rows.append(
+            (
+                stage,
+                len(values),
+                percentile(values, 0.5),
+                percentile(values, 0.95),
+                percentile(values, 0.99),
+            )
+        )
+    return sorted(rows, key=lambda row: row[3], reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency percentiles per turn stage")
+    parser.add_argument("paths", nargs="+", help="span files written by the Therapist")
+    args = parser.parse_args()
+
+    durations, markers = load_durations(args.paths)
+    print(f"{'stage':<20}{'count':>8}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for stage, count, p50, p95, p99 in summarize(durations):
+        print(f"{stage:<20}{count:>8}{p50:>9.2f}s{p95:>9.2f}s{p99:>9.2f}s")
+    if markers:
+        print(f"\n{'marker':<20}{'count':>8}")
+        for stage, count in sorted(markers.items()):
+            print(f"{stage:<20}{count:>8}")
+
+
+if __name__ == "__main__":
+    main()
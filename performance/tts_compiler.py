@@ -0,0 +1,99 @@
+"""
+Compiles the events of the TagTokenizer into as few NAOqi text-to-speech requests as possible.
+
+Every NaoqiTextToSpeechRequest costs a Redis round trip and a TTS warm-up on the robot,
+which is audible as a gap between the pieces of a response. Instead of one request per
+text piece, consecutive pieces are merged into one request:
+
+- pitch and speed changes become the inline NAOqi control sequences \\vct=..\\ and \\rspd=..\\
+- gestures become ^start(animation) annotations, which ALAnimatedSpeech fires at that point
+  in the sentence, just like a bookmark
+
+The pitch shift is an engine parameter that cannot be changed in the middle of an
+utterance, so only a change of pitch shift starts a new request.
+"""
+
+from collections import namedtuple
+
+from tag_parser import Gesture, TextSegment, VoiceChange
+
+SpeechRequest = namedtuple("SpeechRequest", ["text", "pitch", "pitch_shift", "speed"])
+
+DEFAULT_VOICE = {"pitch": 85, "pitch_shift": 2.0, "speed": 100}
+
+# Characters that start a NAOqi control sequence or annotation
+_CONTROL_CHARS = str.maketrans("", "", "\\^")
+
+
+def compile_speech(events, voice_params=None):
+    """
+    Turn a list of events into SpeechRequests. Gestures that have no text left to be
+    attached to are returned as Gesture events so they can be played on their own.
+    Returns (items, voice_params) where voice_params are active after the last event.
+    """
+    voice = dict(voice_params) if voice_params else dict(DEFAULT_VOICE)
+    items = []
+
+    request_voice = None  # voice the current request was started with
+    parts = []  # inline pieces of the current request
+    spoken = False  # the current request contains text
+    inline_voice = None  # pitch and speed currently active inside the request
+    pending_gestures = []  # gestures not yet attached to a request
+
+    def finish():
+        if spoken:
+            items.append(
+                SpeechRequest(
+                    " ".join(parts),
+                    request_voice["pitch"],
+                    request_voice["pitch_shift"],
+                    request_voice["speed"],
+                )
+            )
+
+    for event in events:
+        if isinstance(event, VoiceChange):
+            voice = {
+                "pitch": event.pitch,
+                "pitch_shift": event.pitch_shift,
+                "speed": event.speed,
+            }
+
+        elif isinstance(event, Gesture):
+            if spoken:
+                parts.append("^start({})".format(event.animation))
+            else:
+                pending_gestures.append(event)
+
+        elif isinstance(event, TextSegment):
+            text = event.text.translate(_CONTROL_CHARS).strip()
+            if not text:
+                continue
+
+            if (
+                request_voice is None
+                or voice["pitch_shift"] != request_voice["pitch_shift"]
+            ):
+                finish()
+                request_voice = dict(voice)
+                inline_voice = (voice["pitch"], voice["speed"])
+                parts = []
+                spoken = False
+            elif (voice["pitch"], voice["speed"]) != inline_voice:
+                if voice["pitch"] != inline_voice[0]:
+                    parts.append("\\vct={:d}\\".format(int(round(voice["pitch"]))))
+                if voice["speed"] != inline_voice[1]:
+                    parts.append("\\rspd={:d}\\".format(int(round(voice["speed"]))))
+                inline_voice = (voice["pitch"], voice["speed"])
+
+            # Gestures that came before the first text of a request start together with it
+            parts.extend(
+                "^start({})".format(gesture.animation) for gesture in pending_gestures
+            )
+            pending_gestures = []
+            parts.append(text)
+            spoken = True
+
+    finish()
+    items.extend(pending_gestures)
+    return items, voice
@@ -0,0 +1,104 @@
+"""
+Per-turn latency budget.
+
+Once the patient's transcript is in, the robot has to start answering within `total` seconds.
+The budget hands out time to the stages of the turn and tells them when to degrade instead of
+making the audience wait:
+
+- stt overran (the patient talked for longer than `stt` seconds): ask for a shorter response
+- the LLM would not fit its budget: ask for a shorter response (fewer max_new_tokens)
+- the LLM did not answer within its budget: use a cached or canned response
+- less than `tts` seconds left before speaking: skip the gestures
+
+Every degradation that fired is recorded in `degradations`.
+"""
+
+import threading
+from time import time
+
+SHORT_RESPONSE = "short_response"
+CACHED_RESPONSE = "cached_response"
+CANNED_RESPONSE = "canned_response"
+SKIP_GESTURES = "skip_gestures"
+
+
+class TurnBudget(object):
+    """
+    reset() at the start of a turn, start() when the transcript came in.
+    Before start() the full budget is available.
+    """
+
+    def __init__(
+        self,
+        logger,
+        total=8.0,
+        stt=15.0,
+        llm=6.0,
+        tts=1.0,
+        max_tokens=200,
+        short_tokens=60,
+    ):
+        self.logger = logger
+        self.total = total
+        self.stt = stt
+        self.llm = llm
+        self.tts = tts
+        self.max_tokens = max_tokens
+        self.short_tokens = short_tokens
+
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.deadline = None
+            self.degradations = []
+            self._short = False
+
+    def start(self, listen_time):
+        """The transcript came in after listening for listen_time seconds, the clock starts now."""
+        self.deadline = time() + self.total
+        if listen_time > self.stt:
+            self.logger.info(
+                f"Listening took {listen_time:.1f}s, asking for a short response"
+            )
+            self._short = True
+
+    def remaining(self):
+        if self.deadline is None:
+            return self.total
+        return self.deadline - time()
+
+    def llm_timeout(self):
+        """Seconds the LLM may take, leaving enough time to start speaking before the deadline."""
+        return max(min(self.llm, self.remaining() - self.tts), 0.5)
+
+    def max_new_tokens(self, wanted=None, fits=None):
+        """
+        The response length to ask for: `wanted` tokens (max_tokens by default), but no more
+        than `fits` in the LLM time that is left, and short when listening overran.
+        """
+        tokens = self.max_tokens if wanted is None else wanted
+        if self._short and tokens > self.short_tokens:
+            self.degrade(SHORT_RESPONSE)
+            tokens = self.short_tokens
+        if fits is not None and fits < tokens:
+            self.degrade(SHORT_RESPONSE)
+            tokens = fits
+        return tokens
+
+    def late(self):
+        """True when the deadline is so close that gestures are skipped."""
+        if self.deadline is not None and self.remaining() < self.tts:
+            self.degrade(SKIP_GESTURES)
+            return True
+        return False
+
+    def degrade(self, name):
+        with self._lock:
+            if name in self.degradations:
+                return
+            self.degradations.append(name)
+        self.logger.info(
+            f"Turn budget: degraded with {name} ({self.remaining():.1f}s left)"
+        )
@@ -0,0 +1,116 @@
+"""
+Thread-based engine for running the stages of a conversation turn.
+
+Stages that do not depend on each other (e.g. re-arming the face tracker while the
+speech-to-text is listening) are submitted to a thread pool and run concurrently with
+the stages on the main thread. Every stage is timed, so the overlap between stages can
+be measured, and overlapping can be switched off to compare against a sequential turn.
+"""
+
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from time import perf_counter, time
+
+
+class Turn(object):
+    """
+    The stages of a single turn. Created by TurnEngine.start_turn().
+    """
+
+    def __init__(self, engine, number):
+        self.engine = engine
+        self.number = number
+        self.futures = {}  # stage name -> Future
+        # stage name -> (start, end) in seconds since the turn started
+        self.timings = {}
+        self._start = perf_counter()
+        if engine.tracer is not None:
+            engine.tracer.begin_turn(number)
+
+    def stage(self, name, fn, *args, after=(), **kwargs):
+        """
+        Run fn(*args, **kwargs) in the background and return its Future.
+        The stage waits for the stages (names or futures) in `after` before it starts.
+        When the engine does not overlap stages, the stage runs right away on the calling thread.
+        """
+        dependencies = [
+            self.futures[dep] if isinstance(dep, str) else dep for dep in after
+        ]
+
+        def run():
+            for dependency in dependencies:
+                dependency.result()
+            return self._timed(name, fn, *args, **kwargs)
+
+        if self.engine.overlap:
+            future = self.engine.executor.submit(run)
+        else:
+            future = Future()
+            try:
+                future.set_result(run())
+            except Exception as e:
+                future.set_exception(e)
+
+        self.futures[name] = future
+        return future
+
+    def run(self, name, fn, *args, **kwargs):
+        """Run a stage on the calling thread and return its result."""
+        return self._timed(name, fn, *args, **kwargs)
+
+    def finish(self):
+        """Wait for all background stages and return the stage timings."""
+        wait(list(self.futures.values()))
+        for name, future in self.futures.items():
+            if future.exception() is not None:
+                self.engine.logger.warning(
+                    f"Stage '{name}' failed: {future.exception()}"
+                )
+        return self.timings
+
+    def overlap(self, first, second):
+        """Seconds during which both stages were running."""
+        if first not in self.timings or second not in self.timings:
+            return 0.0
+        start = max(self.timings[first][0], self.timings[second][0])
+        end = min(self.timings[first][1], self.timings[second][1])
+        return max(end - start, 0.0)
+
+    def summary(self):
+        """One line with the start and end time of every stage, in the order they started."""
+        stages = sorted(self.timings.items(), key=lambda item: item[1][0])
+        return ", ".join(
+            f"{name} {start:.2f}-{end:.2f}s" for name, (start, end) in stages
+        )
+
+    def _timed(self, name, fn, *args, **kwargs):
+        start_wall = time()
+        start = perf_counter() - self._start
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            end = perf_counter() - self._start
+            self.timings[name] = (start, end)
+            if self.engine.tracer is not None:
+                self.engine.tracer.record(name, start_wall, end - start)
+
+
+class TurnEngine(object):
+    """
+    Creates turns and owns the thread pool their background stages run on.
+    Set overlap=False to run every stage sequentially, e.g. to measure what overlapping saves.
+    Stage timings are also recorded as spans when a turn_tracing.Tracer is given.
+    """
+
+    def __init__(self, logger, overlap=True, max_workers=4, tracer=None):
+        self.logger = logger
+        self.overlap = overlap
+        self.tracer = tracer
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="turn-stage"
+        )
+
+    def start_turn(self, number):
+        return Turn(self, number)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,75 @@
+"""
+Per-stage latency tracing for the Therapist.
+
+Every stage of a turn (listening, prompt building, each LLM attempt, cleanup, each TTS
+request, each gesture, ...) is recorded as a span and appended to a JSONL file, one file
+per session. Events without a duration (a barge-in, the outcome of a speculative request)
+are recorded as markers. Use trace_summary.py to get the latency percentiles per stage.
+"""
+
+import json
+import os
+import threading
+from contextlib import contextmanager
+from time import perf_counter, time
+
+
+class Tracer(object):
+    """
+    Writes spans to a JSONL file. Spans recorded before start_session() are dropped,
+    so the tracer can be used from the very beginning.
+    """
+
+    def __init__(self):
+        self.session = None
+        self.turn = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def start_session(self, path, session):
+        """Start writing spans of the given session to path."""
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.session = session
+        self._file = open(path, "a", buffering=1)
+
+    def begin_turn(self, turn):
+        """Spans recorded from now on belong to this turn."""
+        self.turn = turn
+
+    @contextmanager
+    def span(self, stage, **attributes):
+        """Time the code inside the with-block as one span of the current turn."""
+        start_wall = time()
+        start = perf_counter()
+        try:
+            yield attributes
+        finally:
+            self.record(stage, start_wall, perf_counter() - start, **attributes)
+
+    def record(self, stage, start, duration, **attributes):
+        """Record a span that was timed elsewhere. start is a time.time() timestamp."""
+        if self._file is None:
+            return
+        span = {
+            "session": self.session,
+            "turn": self.turn,
+            "stage": stage,
+            "start": round(start, 4),
+            "duration": round(duration, 4),
+        }
+        span.update(attributes)
+        line = json.dumps(span)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def mark(self, stage, **attributes):
+        """Record an event of the current turn that has no duration."""
+        self.record(stage, time(), 0, marker=True, **attributes)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,249 @@
+"""
+Local voice-activity endpointing between the NAO mic and GoogleSpeechToText.
+
+The VoiceActivityGate component forwards silence instead of the mic audio until the patient
+starts speaking (with a short pre-roll so the first syllable is not lost), so background noise
+is never transcribed but the Google stream never runs out of audio and times out. As soon as
+the patient has been silent for `hangover` seconds it sends a burst of synthetic silence and
+only forwards silence again. Google's own endpointer counts audio time, not wall time, so the
+burst makes it finalize the transcript right away instead of after hundreds of milliseconds of
+real trailing silence.
+Send a ResetVoiceActivityRequest before every GetStatementRequest to open the gate again.
+
+Speech is detected with webrtcvad when it is installed, otherwise with an adaptive energy
+threshold. `aggressiveness` (0-3) works the same for both: higher filters out more noise.
+
+Start the component before main_script.py with:
+    python voice_activity.py
+"""
+
+from collections import deque
+
+import numpy as np
+from sic_framework.core.component_manager_python2 import SICComponentManager
+from sic_framework.core.component_python2 import SICComponent
+from sic_framework.core.connector import SICConnector
+from sic_framework.core.message_python2 import (
+    AudioMessage,
+    SICConfMessage,
+    SICRequest,
+    SICSuccessMessage,
+)
+
+try:
+    import webrtcvad
+except ImportError:
+    webrtcvad = None
+
+
+class EnergyDetector(object):
+    """
+    Speech when the energy of a frame is well above the noise floor. The noise floor follows
+    the energy of non-speech frames, so it adapts to the room.
+    """
+
+    # Energy ratio above the noise floor that counts as speech, per aggressiveness
+    RATIOS = {0: 1.5, 1: 2.0, 2: 3.0, 3: 4.5}
+
+    def __init__(self, aggressiveness=2, min_rms=200.0, adaptation=0.05):
+        self.ratio = self.RATIOS[aggressiveness]
+        self.min_rms = min_rms
+        self.adaptation = adaptation
+        self.noise_floor = None
+
+    def is_speech(self, frame, sample_rate):
+        samples = np.frombuffer(frame, dtype=np.int16).astype(np.float64)
+        rms = float(np.sqrt(np.mean(samples**2))) if len(samples) else 0.0
+        if self.noise_floor is None:
+            self.noise_floor = rms
+
+        speech = rms > max(self.noise_floor * self.ratio, self.min_rms)
+        if not speech:
+            self.noise_floor += self.adaptation * (rms - self.noise_floor)
+        return speech
+
+
+class WebRTCDetector(object):
+    """The Google WebRTC voice activity detector, frames must be 10, 20 or 30 ms long."""
+
+    def __init__(self, aggressiveness=2):
+        self.vad = webrtcvad.Vad(aggressiveness)
+
+    def is_speech(self, frame, sample_rate):
+        return self.vad.is_speech(frame, sample_rate)
+
+
+def create_detector(aggressiveness=2):
+    if webrtcvad is not None:
+        return WebRTCDetector(aggressiveness)
+    return EnergyDetector(aggressiveness)
+
+
+class Endpointer(object):
+    """
+    Splits 16-bit mono PCM into frames and decides which frames are forwarded as they are and
+    which are replaced by silence, the forwarded audio always lasts as long as the input.
+    States: waiting for speech, speech, ended (after `hangover` seconds of silence).
+    """
+
+    def __init__(
+        self,
+        detector,
+        sample_rate=16000,
+        frame_ms=30,
+        hangover=0.4,
+        pre_roll=0.3,
+        min_speech=0.09,
+    ):
+        self.detector = detector
+        self.sample_rate = sample_rate
+        self.frame_bytes = int(sample_rate * frame_ms / 1000) * 2
+        self.hangover_frames = max(int(hangover * 1000 / frame_ms), 1)
+        self.min_speech_frames = max(int(min_speech * 1000 / frame_ms), 1)
+        self.pre_roll = deque(
+            maxlen=max(int(pre_roll * 1000 / frame_ms), self.min_speech_frames)
+        )
+        self.reset()
+
+    def reset(self):
+        self.state = "waiting"
+        self.pre_roll.clear()
+        self._buffer = b""
+        self._speech_run = 0
+        self._silence_run = 0
+
+    def process(self, pcm):
+        """Returns the frames to forward and whether the utterance ended in this chunk."""
+        if self.state == "ended":
+            return [bytes(len(pcm))], False
+
+        self._buffer += pcm
+        forward = []
+        while len(self._buffer) >= self.frame_bytes:
+            frame = self._buffer[: self.frame_bytes]
+            self._buffer = self._buffer[self.frame_bytes :]
+            speech = self.detector.is_speech(frame, self.sample_rate)
+
+            if self.state == "waiting":
+                if len(self.pre_roll) == self.pre_roll.maxlen:
+                    # The oldest frame drops out of the pre-roll, it is sent as silence
+                    forward.append(bytes(len(frame)))
+                self.pre_roll.append(frame)
+                self._speech_run = self._speech_run + 1 if speech else 0
+                if self._speech_run >= self.min_speech_frames:
+                    self.state = "speech"
+                    forward.extend(self.pre_roll)
+                    self.pre_roll.clear()
+                continue
+
+            forward.append(frame)
+            self._silence_run = 0 if speech else self._silence_run + 1
+            if self._silence_run >= self.hangover_frames:
+                self.state = "ended"
+                forward.append(bytes(len(self._buffer)))
+                self._buffer = b""
+                return forward, True
+        return forward, False
+
+
+class VoiceActivityConf(SICConfMessage):
+    """
+    :param aggressiveness: 0 (forward almost everything) to 3 (only clear speech)
+    :param hangover: seconds of silence after speech that end the utterance
+    :param pre_roll: seconds of audio before the detected speech start that are forwarded too
+    :param flush_silence: seconds of synthetic silence sent when the utterance ended
+    :param frame_ms: frame length of the detector, 10, 20 or 30
+    """
+
+    def __init__(
+        self,
+        aggressiveness=2,
+        hangover=0.4,
+        pre_roll=0.3,
+        flush_silence=1.0,
+        frame_ms=30,
+    ):
+        SICConfMessage.__init__(self)
+        self.aggressiveness = aggressiveness
+        self.hangover = hangover
+        self.pre_roll = pre_roll
+        self.flush_silence = flush_silence
+        self.frame_ms = frame_ms
+
+
+class ResetVoiceActivityRequest(SICRequest):
+    """Open the gate for a new utterance."""
+
+    pass
+
+
+class VoiceActivityGateComponent(SICComponent):
+    """
+    Forwards only the audio of one utterance from the mic to the next component (Google STT).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(VoiceActivityGateComponent, self).__init__(*args, **kwargs)
+        self.endpointer = None
+        self.sample_rate = None
+
+    @staticmethod
+    def get_inputs():
+        return [AudioMessage]
+
+    @staticmethod
+    def get_output():
+        return AudioMessage
+
+    @staticmethod
+    def get_conf():
+        return VoiceActivityConf()
+
+    def on_request(self, request):
+        if (
+            isinstance(request, ResetVoiceActivityRequest)
+            and self.endpointer is not None
+        ):
+            self.endpointer.reset()
+        return SICSuccessMessage()
+
+    def flush(self):
+        """Send flush_silence seconds of silence to the speech recognizer."""
+        sample_rate = self.sample_rate or 16000
+        silence = bytes(int(sample_rate * self.params.flush_silence) * 2)
+        self.output_message(AudioMessage(silence, sample_rate=sample_rate))
+
+    def on_message(self, message):
+        if self.endpointer is None or message.sample_rate != self.sample_rate:
+            self.sample_rate = message.sample_rate
+            self.endpointer = Endpointer(
+                create_detector(self.params.aggressiveness),
+                sample_rate=message.sample_rate,
+                frame_ms=self.params.frame_ms,
+                hangover=self.params.hangover,
+                pre_roll=self.params.pre_roll,
+            )
+
+        frames, ended = self.endpointer.process(message.waveform)
+        if frames:
+            self.output_message(
+                AudioMessage(b"".join(frames), sample_rate=self.sample_rate)
+            )
+        if ended:
+            self.logger.info(
+                "End of utterance detected, flushing the speech recognizer"
+            )
+            self.flush()
+
+
+class VoiceActivityGate(SICConnector):
+    component_class = VoiceActivityGateComponent
+
+
+def main():
+    # Register the component in the component manager
+    SICComponentManager([VoiceActivityGateComponent])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""
+Warm-up of the robot and cloud services before the first turn.
+
+The first request to every service is the slowest: NAOqi loads the TTS engine and the animation
+player, the ngrok tunnel and the backend open their connections, Google STT opens its stream.
+Warmup fires one dummy request per service in parallel (e.g. while the operator confirms the
+start of the show) and reports what each cold start cost.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, wait
+from time import time
+
+from sic_framework.devices.common_naoqi.naoqi_motion import NaoqiAnimationRequest
+from sic_framework.devices.common_naoqi.naoqi_text_to_speech import (
+    NaoqiTextToSpeechRequest,
+)
+
+# A 10 ms pause: loads the speech engine without saying anything
+SILENT_TEXT = "\\pau=10\\"
+
+
+def nao_warmup_tasks(nao, animation=None):
+    """Dummy requests for the text-to-speech engine and, if an animation is given, the animation player."""
+    tasks = {
+        "tts": lambda: nao.tts.request(
+            NaoqiTextToSpeechRequest(SILENT_TEXT, animated=True)
+        )
+    }
+    if animation is not None:
+        tasks["animation"] = lambda: nao.motion.request(
+            NaoqiAnimationRequest(animation)
+        )
+    return tasks
+
+
+class Warmup(object):
+    """
+    Runs named warm-up tasks in parallel. start() returns right away, wait() reports the cost
+    of every task and returns a dict of name to seconds (None for a failed or unfinished task).
+    """
+
+    def __init__(self, tasks, logger, timeout=30):
+        self.tasks = tasks
+        self.logger = logger
+        self.timeout = timeout
+        self.timings = {}
+        self._executor = None
+        self._futures = {}
+
+    def start(self):
+        self.logger.info(f"Warming up: {', '.join(self.tasks)}")
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(len(self.tasks), 1), thread_name_prefix="warmup"
+        )
+        self._futures = {
+            name: self._executor.submit(self._timed, task)
+            for name, task in self.tasks.items()
+        }
+        return self
+
+    def wait(self):
+        wait(self._futures.values(), timeout=self.timeout)
+        for name, future in self._futures.items():
+            if not future.done():
+                self.logger.warning(
+                    f"Warm-up of {name} still running after {self.timeout}s"
+                )
+                self.timings[name] = None
+            elif future.exception() is not None:
+                self.logger.warning(f"Warm-up of {name} failed: {future.exception()}")
+                self.timings[name] = None
+            else:
+                self.timings[name] = future.result()
+                self.logger.info(f"Cold start of {name}: {self.timings[name]:.2f}s")
+        self._executor.shutdown(wait=False)
+        return self.timings
+
+    @staticmethod
+    def _timed(task):
+        start = time()
+        task()
+        return time() - start